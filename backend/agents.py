@@ -5,99 +5,301 @@ load_dotenv()
 # Set LangChain/LangSmith environment variables BEFORE importing crewai
 os.environ["LANGCHAIN_TRACING_V2"] = "true"
 os.environ["LANGCHAIN_PROJECT"] = "casetwin"
+# Batch trace uploads in the background instead of one synchronous POST per
+# LLM/tool event — a crew run emits 20+ of them on the hot path otherwise.
+os.environ.setdefault("LANGSMITH_AUTO_BATCH_TRACING", "true")
+os.environ.setdefault("LANGSMITH_BATCH_SIZE", "50")
 if not os.getenv("LANGCHAIN_API_KEY"):
     print("WARNING: LANGCHAIN_API_KEY not found - LangSmith tracing will not work!")
 
-import json
-import requests
+import asyncio
+import contextvars
+import functools
+import io
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlunsplit
+
+import httpx
+import orjson
 import litellm
+from cachetools import TTLCache
 from crewai import Agent, Task, Crew, Process, LLM
 from crewai.tools import tool
 
+# Shared HTTP/2 client: Keep-Alive reuses sockets across the many tool calls a
+# single crew run makes to ydc-index.io / r.jina.ai, and once the researcher
+# fans out parallel tool calls, HTTP/2 multiplexes the concurrent fetches over
+# one connection per host instead of opening a socket per request.
+_HTTPX = httpx.Client(
+    http2=True,
+    limits=httpx.Limits(
+        max_connections=100,
+        max_keepalive_connections=20,
+        keepalive_expiry=60.0,
+    ),
+    timeout=httpx.Timeout(connect=5.0, read=30.0, write=30.0, pool=5.0),
+    headers={
+        "User-Agent": "CaseTwin/1.0 (specialist-agent)",
+        "Accept-Encoding": "gzip",
+    },
+    transport=httpx.HTTPTransport(retries=3),
+    follow_redirects=True,
+)
+
+# Per-call timeouts: searches should fail fast, Jina renders take longer
+_SEARCH_TIMEOUT = httpx.Timeout(connect=3.0, read=15.0, write=15.0, pool=3.0)
+_JINA_TIMEOUT = httpx.Timeout(connect=5.0, read=35.0, write=35.0, pool=5.0)
+
+
+def _get_with_retry(url: str, *, headers: dict = None, params: dict = None,
+                    timeout: httpx.Timeout = None) -> httpx.Response:
+    """
+    GET with light retry on transient upstream statuses. httpx's transport
+    retries only cover connection errors, so this keeps the 429/5xx retry
+    behavior the urllib3 Retry adapter used to provide — still far cheaper
+    than letting the CrewAI researcher burn an LLM turn re-invoking a tool.
+    """
+    last = None
+    for attempt in range(3):
+        last = _HTTPX.get(url, headers=headers, params=params, timeout=timeout)
+        if last.status_code not in (429, 500, 502, 503, 504):
+            return last
+        retry_after = last.headers.get("Retry-After")
+        delay = float(retry_after) if retry_after and retry_after.isdigit() else 0.25 * (2 ** attempt)
+        # Honor Retry-After but clamp it: an upstream asking for minutes or
+        # hours would block the tool thread far beyond any crew budget.
+        time.sleep(min(delay, 5.0))
+    return last
+
 litellm.success_callback = ["langsmith"]
-litellm.set_verbose = True
+# Verbose litellm logging dumps every multi-KB request/response payload to
+# stderr on each Gemini call — opt in explicitly when debugging.
+if os.getenv("CASETWIN_DEBUG_LLM") == "1":
+    litellm.set_verbose = True
 
 print(f"[LangSmith] Tracing enabled: LANGCHAIN_TRACING_V2={os.getenv('LANGCHAIN_TRACING_V2')}")
 print(f"[LangSmith] Project: {os.getenv('LANGCHAIN_PROJECT')}")
 print(f"[LangSmith] API Key configured: {'Yes' if os.getenv('LANGCHAIN_API_KEY') else 'No'}")
 
 
+# URL patterns that indicate individual doctor profiles (server-rendered, content-rich)
+_PROFILE_RE = re.compile("|".join(map(re.escape, (
+    "/doctor/", "/physician/", "/provider/", "/faculty/", "/staff/",
+    "/find-a-doctor/", "/our-team/", "/profile/", "/bio/",
+    "/physicians/", "/doctors/", "/specialists/", "/expert/",
+))))
+# URL patterns that are likely useless for finding doctors
+_SKIP_RE = re.compile("|".join(map(re.escape, (
+    "/news/", "/blog/", "/events/", "/careers/", "/jobs/",
+    "/location/", "/condition/", "/treatment/", "/service/",
+))))
+_DOCTOR_RE = re.compile(r"dr\.| m\.d\.|, md")
+_KEYWORD_RE = re.compile(r"physician|specialist|surgeon|faculty|board certified")
+
+# Low-score hits past this cutoff only inflate the LLM prompt
+_MAX_RESULTS_PER_QUERY = 6
+
+# Fixed request headers, built once instead of per tool call
+_JINA_HEADERS = {
+    "Accept": "text/markdown",
+    "X-Return-Format": "markdown",
+    "X-Timeout": "30",
+}
+
+
+@functools.lru_cache(maxsize=1)
+def _ydc_headers(api_key: str) -> dict:
+    return {"X-API-Key": api_key}
+
+# Per-crew memo: the LLM often re-searches / re-reads the same URLs across its
+# turns within one crew run. Holds {"pages": {url: content}, "seen_urls": set}.
+# "seen_urls" is scoped to ONE crew; "pages" may be shared between crews.
+_CREW_SCRAPE_CACHE: contextvars.ContextVar = contextvars.ContextVar(
+    "crew_scrape_cache", default=None
+)
+
+
+def _run_one_search(query: str, headers: dict) -> list:
+    """Run a single YouCom query and return scored result dicts."""
+    print(f"[SpecialistAgent] YouCom search: {query}")
+    res = _get_with_retry(
+        "https://ydc-index.io/v1/search",
+        headers=headers,
+        params={"query": query, "count": 10},
+        timeout=_SEARCH_TIMEOUT,
+    )
+    # orjson parses the 50-200 KB payload several times faster than
+    # requests' stdlib-json .json(), straight from the response bytes.
+    data = orjson.loads(res.content)
+
+    results = []
+    hits = data.get("hits", []) or data.get("results", {}).get("web", [])
+
+    for hit in hits:
+        url = hit.get("url", "")
+        title = hit.get("title", "")
+        snippets = hit.get("snippets", [])
+        description = hit.get("description", "")
+        url_l = url.lower()
+        full_text = (title + " " + description + " " + " ".join(snippets)).lower()
+
+        # One C-level regex match per signal instead of ~40 Python `in` probes
+        score = (
+            3 * bool(_PROFILE_RE.search(url_l))
+            - 2 * bool(_SKIP_RE.search(url_l))
+            # Snippets mentioning a named doctor are gold
+            + 3 * bool(_DOCTOR_RE.search(full_text))
+            + bool(_KEYWORD_RE.search(full_text))
+        )
+
+        content = description or " ".join(snippets)
+        results.append({
+            "score": score,
+            "url": url,
+            "text": (
+                f"[SCORE:{score}]\n"
+                f"TITLE: {title}\n"
+                f"URL: {url}\n"
+                f"CONTENT: {content}\n"
+            ),
+        })
+
+    results.sort(key=lambda x: x["score"], reverse=True)
+    return results
+
+
 @tool("YouCom Search Tool")
-def you_search_tool(query: str) -> str:
+def you_search_tool(queries: list[str]) -> str:
     """
     Search the internet for medical information about physicians, hospital staff and specialist directories.
+    Accepts MULTIPLE queries at once and runs them in parallel — always pass every
+    query you need in a single call instead of calling the tool repeatedly.
     Returns page titles, URLs, and content snippets. Read the snippets carefully — they often
     contain doctor names like 'Dr. Jane Smith, MD — Pulmonologist at Hospital X'.
     Args:
-        query (str): The search query (e.g. 'Dr Jane Smith pulmonologist Mayo Clinic profile')
+        queries (list[str]): One or more search queries
+            (e.g. ['Dr Jane Smith pulmonologist Mayo Clinic profile', ...])
     """
     api_key = os.getenv("YDC_API_KEY")
     if not api_key:
         return "Error: YDC_API_KEY environment variable is missing."
+    if isinstance(queries, str):
+        queries = [queries]
 
-    headers = {"X-API-Key": api_key}
+    headers = _ydc_headers(api_key)
     try:
-        print(f"[SpecialistAgent] YouCom search: {query}")
-        res = requests.get(
-            "https://ydc-index.io/v1/search",
-            headers=headers,
-            params={"query": query, "count": 10},
-        )
-        data = res.json()
-
-        # URL patterns that indicate individual doctor profiles (server-rendered, content-rich)
-        profile_patterns = [
-            "/doctor/", "/physician/", "/provider/", "/faculty/", "/staff/",
-            "/find-a-doctor/", "/our-team/", "/profile/", "/bio/",
-            "/physicians/", "/doctors/", "/specialists/", "/expert/",
-        ]
-        # URL patterns that are likely useless for finding doctors
-        skip_patterns = [
-            "/news/", "/blog/", "/events/", "/careers/", "/jobs/",
-            "/location/", "/condition/", "/treatment/", "/service/",
-        ]
-
-        results = []
-        hits = data.get("hits", []) or data.get("results", {}).get("web", [])
-
-        for hit in hits:
-            url = hit.get("url", "")
-            title = hit.get("title", "")
-            snippets = hit.get("snippets", [])
-            description = hit.get("description", "")
-            full_text = (title + " " + description + " " + " ".join(snippets)).lower()
-
-            score = 0
-            if any(p in url.lower() for p in profile_patterns):
-                score += 3
-            if any(p in url.lower() for p in skip_patterns):
-                score -= 2
-            # Snippets mentioning a named doctor are gold
-            if "dr." in full_text or " m.d." in full_text or ", md" in full_text:
-                score += 3
-            if any(w in full_text for w in ["physician", "specialist", "surgeon", "faculty", "board certified"]):
-                score += 1
-
-            content = description or " ".join(snippets)
-            results.append({
-                "score": score,
-                "text": (
-                    f"[SCORE:{score}]\n"
-                    f"TITLE: {title}\n"
-                    f"URL: {url}\n"
-                    f"CONTENT: {content}\n"
-                ),
-            })
-
-        results.sort(key=lambda x: x["score"], reverse=True)
-        texts = [r["text"] for r in results]
-        print(f"[SpecialistAgent] {len(texts)} results (ranked by relevance).")
-        return "\n\n---\n\n".join(texts) if texts else "No results found."
+        with ThreadPoolExecutor(max_workers=min(len(queries), 4)) as pool:
+            per_query = list(pool.map(lambda q: _run_one_search(q, headers), queries))
+
+        # Single-pass writer; only the top hits per query make it into the
+        # prompt — the agent never reads the low-score tail, and the extra
+        # tokens just slow down (and bill) every Gemini turn.
+        # Drop hits whose URL was already surfaced earlier in this crew run —
+        # repeat searches keep resurfacing the same directory pages.
+        crew_cache = _CREW_SCRAPE_CACHE.get()
+        seen_urls = crew_cache["seen_urls"] if crew_cache is not None else set()
+
+        out = io.StringIO()
+        for query, results in zip(queries, per_query):
+            fresh = []
+            for r in results:
+                key = _normalize_url(r["url"]) if r["url"] else r["text"]
+                if key not in seen_urls:
+                    seen_urls.add(key)
+                    fresh.append(r)
+            top = fresh[:_MAX_RESULTS_PER_QUERY]
+            print(f"[SpecialistAgent] '{query}': keeping {len(top)}/{len(results)} results.")
+            out.write(f"=== QUERY: {query} ===\n\n")
+            if not top:
+                out.write("No results found.")
+            else:
+                for i, r in enumerate(top):
+                    if i:
+                        out.write("\n\n---\n\n")
+                    out.write(r["text"])
+            out.write("\n\n\n")
+        return out.getvalue().rstrip("\n")
     except Exception as e:
         print(f"[SpecialistAgent] Search failed: {e}")
         return f"Search failed: {str(e)}"
 
 
+# Cross-run page cache: hospital directory pages change over days, not seconds,
+# so re-scraping the same URL for every patient/diagnosis is pure waste. 24h TTL.
+_PAGE_CACHE = TTLCache(maxsize=512, ttl=86400)
+_PAGE_CACHE_LOCK = threading.Lock()
+
+
+def _normalize_url(url: str) -> str:
+    """Cache key: lowercase host, no query string, no trailing slash."""
+    parts = urlsplit(url)
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip("/"), "", ""))
+
+
+def _read_page(url: str) -> str:
+    """Fetch one URL through Jina's rendering proxy, truncated for LLM context.
+
+    Results are cached by normalized URL for 24h so repeat crew runs skip the
+    ~30s rendered fetch entirely.
+    """
+    cache_key = _normalize_url(url)
+
+    # Tier 1: per-crew memo (perfect hit rate on repeat reads within a run,
+    # and remembers failures too so the agent can't hammer a dead URL)
+    crew_cache = _CREW_SCRAPE_CACHE.get()
+    if crew_cache is not None and cache_key in crew_cache["pages"]:
+        print(f"[WebReader] Crew-cache hit for {url}")
+        return crew_cache["pages"][cache_key]
+
+    # Tier 2: cross-run TTL cache
+    with _PAGE_CACHE_LOCK:
+        cached = _PAGE_CACHE.get(cache_key)
+    if cached is not None:
+        print(f"[WebReader] Cache hit for {url}")
+        if crew_cache is not None:
+            crew_cache["pages"][cache_key] = cached
+        return cached
+
+    try:
+        jina_url = f"https://r.jina.ai/{url}"
+        # Stream and stop once we have enough for the 6000-char cap — no point
+        # downloading a multi-megabyte markdown body just to slice it.
+        buf = io.StringIO()
+        with _HTTPX.stream("GET", jina_url, headers=_JINA_HEADERS, timeout=_JINA_TIMEOUT) as resp:
+            status_ok = resp.is_success
+            status_code = resp.status_code
+            for chunk in resp.iter_text(chunk_size=2048):
+                buf.write(chunk)
+                if buf.tell() >= 6500:
+                    break
+        content = buf.getvalue().strip()
+        # Cap at 6000 chars to stay within LLM context limits
+        if len(content) > 6000:
+            content = content[:6000] + "\n...[content truncated]"
+        print(f"[WebReader] Read {len(content)} chars from {url} (HTTP {status_code})")
+        if not status_ok:
+            # A transient Jina 429/402/5xx error page must never be served
+            # from the 24h cache; remember it in the per-crew memo only so
+            # the next run retries.
+            content = f"Failed to read {url}: upstream returned HTTP {status_code}."
+        elif not content:
+            content = "Page returned no readable content."
+        else:
+            with _PAGE_CACHE_LOCK:
+                _PAGE_CACHE[cache_key] = content
+        if crew_cache is not None:
+            crew_cache["pages"][cache_key] = content
+        return content
+    except Exception as e:
+        result = f"Failed to read {url}: {str(e)}"
+        if crew_cache is not None:
+            crew_cache["pages"][cache_key] = result
+        return result
+
+
 @tool("JS-Aware Web Page Reader")
 def web_reader_tool(url: str) -> str:
     """
@@ -107,78 +309,104 @@ def web_reader_tool(url: str) -> str:
     Args:
         url (str): The full URL to read (e.g. 'https://hospital.com/find-a-doctor/pulmonology')
     """
-    try:
-        jina_url = f"https://r.jina.ai/{url}"
-        resp = requests.get(
-            jina_url,
-            headers={
-                "Accept": "text/markdown",
-                "X-Return-Format": "markdown",
-                "X-Timeout": "30",
-            },
-            timeout=35,
-        )
-        content = resp.text.strip()
-        # Cap at 6000 chars to stay within LLM context limits
-        if len(content) > 6000:
-            content = content[:6000] + "\n...[content truncated]"
-        print(f"[WebReader] Read {len(content)} chars from {url}")
-        return content if content else "Page returned no readable content."
-    except Exception as e:
-        return f"Failed to read {url}: {str(e)}"
+    return _read_page(url)
 
 
-def analyze_hospital_staff(url: str, diagnosis: str, hospital_name: str, location: str = "") -> list:
+@tool("Batch JS-Aware Web Page Reader")
+def web_reader_batch_tool(urls: list[str]) -> str:
     """
-    Two-agent CrewAI crew: researcher finds physicians, extractor structures the data.
-    Returns up to 5 dicts: name, specialty, credentials, context, url, phone.
+    Read SEVERAL web pages at once — pass all the doctor profile URLs you want
+    to read in a single call and they are fetched in parallel, which is much
+    faster than reading pages one at a time.
+    Uses Jina.ai to fully render each page before returning clean markdown content.
+    Args:
+        urls (list[str]): The full URLs to read
+            (e.g. ['https://hospital.com/doctor/jane-smith', ...])
     """
-    print(f"[SpecialistAgent] Starting crew for '{hospital_name}' | diagnosis: '{diagnosis}'")
+    if isinstance(urls, str):
+        urls = [urls]
+    if not urls:
+        return "No URLs provided."
+
+    with ThreadPoolExecutor(max_workers=min(len(urls), 5)) as pool:
+        contents = list(pool.map(_read_page, urls))
+
+    return "\n\n".join(
+        f"=== URL: {url} ===\n{content}" for url, content in zip(urls, contents)
+    )
 
-    from langsmith import traceable
 
+@functools.lru_cache(maxsize=1)
+def _get_llm() -> LLM:
     google_api_key = os.getenv("GEMINI_API_KEY")
     if not google_api_key:
         print("Warning: GEMINI_API_KEY not found.")
-
-    llm = LLM(
+    return LLM(
         model="gemini/gemini-2.5-flash",
         api_key=google_api_key,
         temperature=0.1,
     )
 
-    hospital_domain = url.split("/")[2] if url and "://" in url else hospital_name
 
-    # ── Agent 1: Medical Intelligence Researcher ─────────────────────────────
-    researcher = Agent(
-        role="Medical Intelligence Researcher",
+def _get_agents() -> tuple:
+    """
+    Build the three crew agents for one run.
+
+    Agents must be per-run: CrewAI mutates run state on the agent itself
+    (crew backref at Crew construction, agent_executor rebuilt inside
+    execute_task), so sharing instances across concurrent kickoffs lets runs
+    swap each other's executors and cross-contaminate hospital contexts. The
+    expensive part — the LLM client — stays process-cached via _get_llm();
+    Agent construction itself is cheap.
+    """
+    llm = _get_llm()
+
+    # ── Agent 1a: Snippet Researcher (fast — search snippets only) ───────────
+    snippet_researcher = Agent(
+        role="Medical Snippet Researcher",
+        goal=(
+            "Find the real names and credentials of physicians at the target hospital "
+            "who treat or specialise in the requested diagnosis, using search snippets only."
+        ),
+        backstory=(
+            "You are a specialist medical researcher. Your most important insight: YouCom "
+            "search result SNIPPETS often already contain physician names like 'Dr. Jane "
+            "Smith, MD, specializes in the requested condition at the hospital' — read every "
+            "snippet carefully and extract names directly. You never scrape pages."
+        ),
+        tools=[you_search_tool],
+        verbose=True,
+        llm=llm,
+        max_iter=2,
+    )
+
+    # ── Agent 1b: Profile Researcher (slow — scrapes individual profiles) ────
+    profile_researcher = Agent(
+        role="Medical Profile Researcher",
         goal=(
-            f"Find the real names, credentials, and direct profile URLs of physicians at "
-            f"{hospital_name} who treat or specialise in {diagnosis}."
+            "Find direct profile URLs of physicians at the target hospital who treat "
+            "the requested diagnosis, and scrape those individual profile pages for details."
         ),
         backstory=(
-            f"You are a specialist medical researcher. You know that hospital homepages never "
-            f"list doctors — you must go deeper. Your most important insight: YouCom search result "
-            f"SNIPPETS often already contain physician names like 'Dr. Jane Smith, MD, specializes "
-            f"in {diagnosis} at {hospital_name}' — read every snippet carefully and extract names "
-            f"directly before deciding to read any pages. "
-            f"When you need to read a page, use the JS-Aware Web Page Reader — it fully renders "
-            f"JavaScript so hospital 'Find a Doctor' pages and physician directory listings work "
-            f"correctly. Target INDIVIDUAL doctor profile pages for the richest data: full bio, "
-            f"credentials, board certifications, phone number, and accepting-patients status."
+            "You are a specialist medical researcher. You know that hospital homepages never "
+            "list doctors — you must go deeper. When you need to read a page, use the Batch "
+            "JS-Aware Web Page Reader — it fully renders JavaScript so hospital 'Find a "
+            "Doctor' pages and physician directory listings work correctly. Target INDIVIDUAL "
+            "doctor profile pages for the richest data: full bio, credentials, board "
+            "certifications, phone number, and accepting-patients status."
         ),
-        tools=[you_search_tool, web_reader_tool],
+        tools=[you_search_tool, web_reader_tool, web_reader_batch_tool],
         verbose=True,
         llm=llm,
-        max_iter=8,
+        max_iter=4,
     )
 
     # ── Agent 2: Precision Data Extractor ────────────────────────────────────
     extractor = Agent(
         role="Precision Medical Data Extractor",
         goal=(
-            f"Produce a clean JSON list of 3–5 physicians relevant to {diagnosis} "
-            f"from the researcher's report."
+            "Produce a clean JSON list of 3–5 physicians relevant to the requested "
+            "diagnosis from the researchers' reports."
         ),
         backstory=(
             "You are a precision data extractor. You never hallucinate doctor names. "
@@ -192,90 +420,127 @@ def analyze_hospital_staff(url: str, diagnosis: str, hospital_name: str, locatio
         llm=llm,
     )
 
-    # ── Task 1: Deep physician research ──────────────────────────────────────
-    research_task = Task(
+    return snippet_researcher, profile_researcher, extractor
+
+
+def analyze_hospital_staff(url: str, diagnosis: str, hospital_name: str, location: str = "") -> list:
+    """
+    Three-agent CrewAI pipeline: snippet and profile researchers run as
+    concurrent single-task crews, then an extractor crew structures their
+    merged reports. Returns up to 5 dicts: name, specialty, credentials,
+    context, url, phone.
+    """
+    print(f"[SpecialistAgent] Starting crew for '{hospital_name}' | diagnosis: '{diagnosis}'")
+
+    from langsmith import traceable
+
+    snippet_researcher, profile_researcher, extractor = _get_agents()
+
+    hospital_domain = url.split("/")[2] if url and "://" in url else hospital_name
+
+    # ── Task 1a: Snippet-only research (no scraping) ─────────────────────────
+    # Task prompts are deliberately terse: Gemini re-sees them every turn, so
+    # every redundant line here is paid max_iter times. The how-to guidance
+    # lives once in the agent backstories.
+    snippet_task = Task(
         description=f"""
-Find real physicians who treat **{diagnosis}** at **{hospital_name}** (domain: {hospital_domain}).
-
-Work through these steps IN ORDER. Stop once you have 3+ named physicians with credentials.
-
----
-**STEP 1 — Read snippets for instant doctor names (no scraping needed):**
-Search: `"{hospital_name}" "{diagnosis}" physician specialist doctor`
-→ Read EVERY snippet and title carefully. They frequently contain gold like:
-  "Dr. Alan M. Smith, MD, FCCP — Interventional Pulmonologist at {hospital_name}..."
-→ Write down every doctor name, credential, and specialty you find in the snippets.
-
----
-**STEP 2 — Find the physician directory / Find-a-Doctor page:**
-Search: `"{hospital_name}" find a doctor {diagnosis} specialist physician directory`
-→ From the results, identify 2 URLs that look like physician directory pages:
-  (e.g. /find-a-doctor/, /our-providers/, /physician-directory/, /doctors/)
-→ DO NOT scrape directory listing pages — they are JavaScript-rendered and return nothing.
-→ Instead, look at the snippets for any doctor names mentioned.
-
----
-**STEP 3 — Scrape individual doctor profile pages:**
-Search: `site:{hospital_domain} {diagnosis} physician biography profile credentials`
-OR: `"{hospital_name}" {diagnosis} doctor biography "board certified" OR "MD" OR "fellowship"`
-→ Look for URLs to INDIVIDUAL doctor profiles (deep URLs like /doctor/firstname-lastname)
-→ Read 2–3 of these individual profile pages with JS-Aware Web Page Reader
-→ Individual profiles have: full name, MD/PhD credentials, board certifications, bio, phone
-
----
-**STEP 4 — Fallback (only if steps 1–3 yield fewer than 3 doctors):**
-Search: `"{hospital_name}" {diagnosis} department head chief specialist {location}`
-→ Extract any department names, division chiefs, or program directors found.
-
-Compile a detailed report with everything you found: names, credentials, specialties, URLs, phones.
+Find physicians treating {diagnosis} at {hospital_name} — from search snippets ONLY.
+Call the YouCom Search Tool ONCE with all three queries:
+1. `"{hospital_name}" "{diagnosis}" physician specialist doctor`
+2. `"{hospital_name}" find a doctor {diagnosis} specialist physician directory`
+3. `"{hospital_name}" {diagnosis} department head chief specialist {location}`
+Report every doctor name, credential and specialty found in the snippets/titles,
+plus department names and division chiefs as fallback. Never scrape pages.
 """,
-        expected_output=(
-            "A detailed report listing physician names with credentials, specialties, profile URLs, "
-            "and contact information found at the hospital for the diagnosis. Include raw text "
-            "snippets that mention specific doctor names."
-        ),
-        agent=researcher,
+        expected_output="Physician names, credentials, specialties and the raw snippets naming them.",
+        agent=snippet_researcher,
     )
 
-    # ── Task 2: Structured JSON extraction ───────────────────────────────────
-    extract_task = Task(
+    # ── Task 1b: Individual profile scraping ─────────────────────────────────
+    profile_task = Task(
         description=f"""
-Read the researcher's report and extract physician data into a clean JSON array.
-
-**Rules:**
-- Only include individuals with a real last name found in the report (no generic "Specialist" entries)
-- "name": Full name with title — e.g. "Dr. Sarah Johnson" (never just a department name alone)
-- "specialty": Precise specialty relevant to {diagnosis} — e.g. "Interventional Pulmonology"
-- "credentials": All credentials and certifications — e.g. "MD, FCCP, Board Certified Pulmonologist"
-- "context": One sentence with the most relevant clinical fact — e.g. "Performs 200+ bronchoscopies annually and leads the lung nodule clinic"
-- "url": The physician's OWN profile page URL found in the report (e.g. /doctor/jane-smith or /physician/12345).
-  If no specific profile URL was found for this individual, fall back to the hospital URL: "{url}"
-- "phone": Phone number if found, else empty string ""
-
-**Output size:** Return 3 to 5 objects. If fewer than 3 named physicians were found, add the most relevant specialty departments or programs as entries (using department name as "name", "Department" as credentials).
-
-Output ONLY the raw JSON array — no markdown, no preamble:
-[{{"name": "...", "specialty": "...", "credentials": "...", "context": "...", "url": "...", "phone": ""}}]
+Find and read INDIVIDUAL doctor profile pages for {diagnosis} at {hospital_name}.
+1. Search: `site:{hospital_domain} {diagnosis} physician biography profile credentials`
+2. Pick 2–3 individual profile URLs (deep URLs like /doctor/firstname-lastname; never
+   directory listing pages) and read them ALL in ONE call to the Batch JS-Aware Web Page Reader.
+Report names, credentials, board certifications, specialties, profile URLs and phones.
 """,
-        expected_output="A JSON array of 3–5 physician/department objects with all required fields.",
-        agent=extractor,
-        context=[research_task],
+        expected_output="Physician names, credentials, specialties, profile URLs and phones from the profile pages.",
+        agent=profile_researcher,
     )
 
-    crew = Crew(
-        agents=[researcher, extractor],
-        tasks=[research_task, extract_task],
+    # ── Task 2: Structured JSON extraction ───────────────────────────────────
+    extract_description = f"""
+Extract physicians from the two research reports below into a raw JSON array — no markdown, no preamble:
+[{{"name": "...", "specialty": "...", "credentials": "...", "context": "...", "url": "...", "phone": ""}}]
+Rules:
+- "name": real full name with title from a report (e.g. "Dr. Sarah Johnson"); never a bare department name
+- "specialty": precise specialty relevant to {diagnosis}
+- "credentials": all credentials/certifications found (MD, PhD, FACS, board certifications)
+- "context": one sentence with the most relevant clinical fact
+- "url": the physician's OWN profile URL from the report; else fall back to "{url}"
+- "phone": phone number if found, else ""
+Return 3–5 objects. If fewer than 3 named physicians, pad with the most relevant
+departments (department name as "name", "Department" as credentials).
+"""
+
+    # The two research tasks are independent (snippets vs profile scraping), so
+    # they run as concurrent single-task crews; wall-clock is max() of the two
+    # instead of their sum. The extractor then merges both reports.
+    snippet_crew = Crew(
+        agents=[snippet_researcher],
+        tasks=[snippet_task],
+        process=Process.sequential,
+        verbose=True,
+    )
+    profile_crew = Crew(
+        agents=[profile_researcher],
+        tasks=[profile_task],
         process=Process.sequential,
         verbose=True,
     )
 
+    async def _run_research():
+        pages: dict = {}
+
+        async def _kick(crew):
+            # Each concurrent crew gets its own seen_urls scope: dedup across
+            # the two would let whichever researcher searches first silently
+            # steal URLs from the other's results (the profile researcher's
+            # site: query can come back "No results found" for the exact
+            # profile pages it exists to scrape). The page cache stays shared
+            # — a scraped page is the same whoever fetched it. gather() wraps
+            # each coroutine in its own task with its own context copy, so
+            # this set() is invisible to the sibling crew.
+            _CREW_SCRAPE_CACHE.set({"pages": pages, "seen_urls": set()})
+            return await crew.kickoff_async()
+
+        return await asyncio.gather(_kick(snippet_crew), _kick(profile_crew))
+
     @traceable(
         name="hospital_specialist_extraction",
         project_name="casetwin",
         metadata={"hospital": hospital_name, "diagnosis": diagnosis, "location": location, "url": url},
     )
     def run_crew():
-        return crew.kickoff()
+        snippet_result, profile_result = asyncio.run(_run_research())
+
+        extract_task = Task(
+            description=(
+                extract_description
+                + f"\n## Snippet research report\n{getattr(snippet_result, 'raw', str(snippet_result))}\n"
+                + f"\n## Profile research report\n{getattr(profile_result, 'raw', str(profile_result))}\n"
+            ),
+            expected_output="A JSON array of 3–5 physician/department objects with all required fields.",
+            agent=extractor,
+        )
+        extract_crew = Crew(
+            agents=[extractor],
+            tasks=[extract_task],
+            process=Process.sequential,
+            verbose=True,
+        )
+        return extract_crew.kickoff()
 
     try:
         result = run_crew()
@@ -288,7 +553,7 @@ Output ONLY the raw JSON array — no markdown, no preamble:
             output_str = output_str[:-3]
         output_str = output_str.strip()
 
-        data = json.loads(output_str)
+        data = orjson.loads(output_str)
         if isinstance(data, list):
             return data[:5]
         return []
@@ -297,3 +562,41 @@ Output ONLY the raw JSON array — no markdown, no preamble:
         traceback.print_exc()
         print(f"[SpecialistAgent] Extraction failed: {e}")
         return []
+
+
+# Dedicated pool for crew runs: a crew blocks its thread for the full 30-60s
+# of execution, so it must never run on an async server's event loop thread.
+_CREW_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="crew")
+
+
+async def analyze_hospital_staff_async(url: str, diagnosis: str, hospital_name: str, location: str = "") -> list:
+    """
+    Async wrapper around analyze_hospital_staff that runs the crew on the
+    dedicated worker pool, keeping the caller's event loop free.
+    """
+    return await asyncio.get_running_loop().run_in_executor(
+        _CREW_POOL, analyze_hospital_staff, url, diagnosis, hospital_name, location
+    )
+
+
+async def analyze_hospitals_batch(jobs: list, max_concurrency: int = 4) -> list:
+    """
+    Run analyze_hospital_staff for several hospitals concurrently.
+
+    Each job is a dict with the keyword arguments of analyze_hospital_staff
+    (url, diagnosis, hospital_name, optional location). Crew runs are fanned
+    out to worker threads, capped by a semaphore to respect Gemini rate
+    limits. Returns one specialist list per job, in input order.
+    """
+    sem = asyncio.Semaphore(max_concurrency)
+
+    async def _run(job: dict) -> list:
+        async with sem:
+            return await analyze_hospital_staff_async(
+                job["url"],
+                job["diagnosis"],
+                job["hospital_name"],
+                job.get("location", ""),
+            )
+
+    return await asyncio.gather(*(_run(job) for job in jobs))
@@ -11,22 +11,43 @@ load_dotenv()
 os.environ["LANGCHAIN_TRACING_V2"] = "true"
 os.environ["LANGCHAIN_PROJECT"] = "casetwin"
 
+import asyncio
+import bisect
+import hashlib
 import io
 import json
+import logging
+import random
 import re
-import uuid
-from datetime import datetime
+import threading
+from collections import OrderedDict
+from tempfile import SpooledTemporaryFile
 from typing import List, Optional
 
-from fastapi import FastAPI, File, Form, HTTPException, UploadFile
-from fastapi.responses import StreamingResponse
+import httpx
+import numpy as np
+import orjson
+from cachetools import TTLCache
+from fastapi import Depends, FastAPI, File, Form, HTTPException, UploadFile
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from geopy.geocoders import Nominatim
 from PIL import Image
 
-from embedding_service import generate_embedding, query_medgemma
+import agents
+from embedding_service import (
+    generate_embedding,
+    query_medgemma,
+    query_medgemma_batch,
+    query_medgemma_stream,
+    register_static_image,
+)
 from qdrant_service import search_similar
 
-app = FastAPI(title="CaseTwin API", version="1.0.0")
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+logger = logging.getLogger(__name__)
+
+app = FastAPI(title="CaseTwin API", version="1.0.0", default_response_class=ORJSONResponse)
 
 # Origins: comma-separated list injected via ALLOWED_ORIGINS env var in prod.
 # Falls back to localhost dev origins when the var is not set.
@@ -44,15 +65,448 @@ app.add_middleware(
 )
 
 
+# ──────────────────────────────────────────────────────────────────────────────
+# Shared outbound HTTP client — keepalive connections to You.com, OSRM and
+# image hosts persist across requests instead of paying a fresh TLS handshake
+# per call.
+# ──────────────────────────────────────────────────────────────────────────────
+@app.on_event("startup")
+async def _open_http_client():
+    app.state.http = httpx.AsyncClient(
+        timeout=30.0,
+        limits=httpx.Limits(max_keepalive_connections=32, max_connections=128),
+    )
+    _BATCHER.start()
+
+
+@app.on_event("shutdown")
+async def _close_http_client():
+    _BATCHER.stop()
+    await app.state.http.aclose()
+
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
 
+# ──────────────────────────────────────────────────────────────────────────────
+# Regexes applied to every model response — compiled once at import instead of
+# inside the request handlers.
+# ──────────────────────────────────────────────────────────────────────────────
+_BOX_RE = re.compile(r'\[\s*(\d+)\s*,\s*(\d+)\s*,\s*(\d+)\s*,\s*(\d+)\s*\]')
+_CODE_FENCE_RE = re.compile(r"^```(?:markdown)?\s*", re.IGNORECASE)
+_TRAIL_FENCE_RE = re.compile(r"```$")
+_BOXED_RE = re.compile(r"\$?\\?boxed\{(.+?)\}\$?", re.DOTALL)
+_SENT_SPLIT_RE = re.compile(r"(?<=[.!?])\s+")
+_LEAD_NONWORD_RE = re.compile(r"^[\W_]+")
+# Deletes every non-word character in one C-level str.translate pass —
+# cheaper than running \W+ through the regex engine for each dedup key.
+# Seeded with Latin-1; higher codepoints (em-dashes, smart quotes, ...) are
+# classified on first sight and cached, so the keys match \W+ stripping
+# instead of letting those characters differentiate otherwise-equal items.
+class _NonWordTable(dict):
+    def __missing__(self, cp):
+        ch = chr(cp)
+        res = self[cp] = cp if (ch.isalnum() or ch == "_") else None
+        return res
+
+
+_STRIP_NONWORD = _NonWordTable(
+    (ord(c), None) for c in map(chr, range(256)) if not (c.isalnum() or c == "_")
+)
+
+
+def _dedup_text(text: str, max_items: int = None, granularity: str = "line") -> str:
+    """
+    Single-pass removal of repeated lines or sentences from model output (the
+    VLM sometimes loops). Line keys are the full normalized line — distinct
+    findings routinely share a long lead-in, so prefix keys would drop real
+    content; sentence keys are 60-char prefixes so slight variations of a
+    repeated insight still collapse. `max_items` caps the output with an
+    early exit.
+    """
+    if granularity == "sentence":
+        parts = _SENT_SPLIT_RE.split(text)
+        joiner = " "
+        key_len = 60
+    else:
+        parts = text.split("\n")
+        joiner = "\n\n"
+        key_len = None
+
+    seen = set()
+    out = []
+    for part in filter(None, map(str.strip, parts)):
+        norm = part.lower().translate(_STRIP_NONWORD)[:key_len]
+        if norm in seen:
+            continue
+        seen.add(norm)
+        out.append(part)
+        if max_items is not None and len(out) >= max_items:
+            break
+    return joiner.join(out)
+
+
+def _clean_reply(reply: str, header: str) -> str:
+    """Shared cleanup for MedGemma section replies: drop everything before the
+    section header, trim a trailing 'Final Answer' block, strip LaTeX boxing
+    and leading punctuation, then collapse repeated lines."""
+    # partition/rpartition over split: no list of every chunk, and the
+    # not-found case hands back the original string so no `in` pre-scan.
+    reply = reply.rpartition(header)[2]
+    reply = reply.partition("Final Answer")[0].strip()
+    reply = reply.replace("\\boxed{", "")
+    if reply.endswith("}"):
+        reply = reply[:-1].strip()
+    reply = _LEAD_NONWORD_RE.sub("", reply)
+    return _dedup_text(reply)
+
+
+# 3x3 lookup table for describing a bounding-box position on the 0-1000
+# normalized coordinate grid; indexed via bisect on the bucket edges.
+_REGIONS = (
+    ("upper left", "upper central", "upper right"),
+    ("mid left", "mid central", "mid right"),
+    ("lower left", "lower central", "lower right"),
+)
+_REGION_EDGES = (333, 666)
+
+
+def _decode_image(fp) -> Image.Image:
+    """
+    Decode an uploaded X-ray at reduced resolution. The downstream models
+    resize to 448/336 px anyway, so decoding a 3000x3000 scan at full size is
+    wasted CPU and memory. JPEGs use PIL draft mode, letting libjpeg downscale
+    straight from the DCT coefficients; other formats get a bounding thumbnail.
+    """
+    image = Image.open(fp)
+    if image.format == "JPEG":
+        image.draft("RGB", (448, 448))
+    else:
+        image.thumbnail((896, 896), Image.Resampling.BILINEAR)
+    return image.convert("RGB")
+
+
+# Placeholder frame for text-only MedGemma calls — allocated once, not per
+# request. Never mutated by callers; registering it caches its base64
+# encoding so text-only queries skip the PNG encode too.
+_DUMMY_IMG = Image.new("RGB", (336, 336), color=(0, 0, 0))
+register_static_image(_DUMMY_IMG)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# MedGemma response cache — /explain_selection sees the same terms over and
+# over ("cardiomegaly", "consolidation") and /enhance_profile retries resend an
+# unchanged profile digest; identical prompts should not pay a second GPU
+# round-trip within the hour.
+# ──────────────────────────────────────────────────────────────────────────────
+_MEDGEMMA_CACHE = TTLCache(maxsize=10_000, ttl=3600)
+
+
+class _MedGemmaBatcher:
+    """
+    Dynamic batcher for single-image MedGemma generations. Concurrent calls
+    are queued and flushed as one batched HF request once 8 have accumulated
+    or 20ms have passed, whichever comes first — N prefills collapse into one
+    launch under load while a lone request only waits for its own call.
+    """
+
+    MAX_BATCH = 8
+    WINDOW_S = 0.02
+
+    def __init__(self):
+        self._queue: asyncio.Queue = None
+        self._worker_task = None
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._worker_task = asyncio.create_task(self._worker())
+
+    def stop(self):
+        if self._worker_task:
+            self._worker_task.cancel()
+
+    async def submit(self, image, prompt: str, max_tokens: int, stop_sequences: list = None):
+        if self._queue is None:
+            # Startup hook hasn't run (scripts/tests) — degrade to a direct call
+            return await asyncio.to_thread(
+                query_medgemma, image, prompt=prompt,
+                max_tokens=max_tokens, stop_sequences=stop_sequences,
+            )
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((image, prompt, max_tokens, stop_sequences, fut))
+        return await fut
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.WINDOW_S
+            while len(batch) < self.MAX_BATCH:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._dispatch(batch)
+            except Exception:
+                # A failed batch must never kill the scheduler: every later
+                # submit would enqueue a future that is never resolved.
+                logger.exception("MedGemma batch dispatch failed")
+
+    @staticmethod
+    def _resolve(fut, result=None, exc=None):
+        """Resolve a caller future, tolerating callers that gave up — a
+        timed-out/cancelled submit leaves a done future behind, and
+        set_result on it would raise InvalidStateError."""
+        if fut.done():
+            return
+        if exc is not None:
+            fut.set_exception(exc)
+        else:
+            fut.set_result(result)
+
+    async def _dispatch(self, batch):
+        if len(batch) == 1:
+            image, prompt, max_tokens, stops, fut = batch[0]
+            try:
+                resp = await asyncio.to_thread(
+                    query_medgemma, image, prompt=prompt,
+                    max_tokens=max_tokens, stop_sequences=stops,
+                )
+                self._resolve(fut, result=resp)
+            except Exception as e:
+                self._resolve(fut, exc=e)
+            return
+
+        try:
+            resp = await asyncio.to_thread(
+                query_medgemma_batch,
+                [item[0] for item in batch],
+                [item[1] for item in batch],
+                [item[2] for item in batch],
+                [item[3] for item in batch],
+            )
+        except Exception as e:
+            for item in batch:
+                self._resolve(item[4], exc=e)
+            return
+
+        for i, item in enumerate(batch):
+            out = resp[i] if isinstance(resp, list) and i < len(resp) else resp
+            # Callers expect the single-call shape: a list of generation dicts
+            self._resolve(item[4], result=out if isinstance(out, list) else [out])
+
+
+_BATCHER = _MedGemmaBatcher()
+
+
+async def _cached_query_medgemma(image, prompt: str, max_tokens: int,
+                                 stop_sequences: list = None, img_key: str = "dummy"):
+    key = hashlib.sha256(f"{prompt}|{img_key}|{max_tokens}".encode()).hexdigest()
+    hit = _MEDGEMMA_CACHE.get(key)
+    if hit is not None:
+        return hit
+    resp = await _BATCHER.submit(image, prompt, max_tokens, stop_sequences)
+    _MEDGEMMA_CACHE[key] = resp
+    return resp
+
+
+async def _cached_query_medgemma_batch(image, prompts: list, tokens: list, stops: list,
+                                       img_key: str = "dummy") -> list:
+    """
+    Batch variant of _cached_query_medgemma for several prompts sharing one
+    image: cached entries are reused, and all misses go out together in a
+    single batched request so the image is encoded once server-side.
+    """
+    keys = [
+        hashlib.sha256(f"{p}|{img_key}|{t}".encode()).hexdigest()
+        for p, t in zip(prompts, tokens)
+    ]
+    results = [_MEDGEMMA_CACHE.get(k) for k in keys]
+    miss = [i for i, r in enumerate(results) if r is None]
+    if not miss:
+        return results
+    if len(miss) == 1:
+        i = miss[0]
+        results[i] = await _cached_query_medgemma(image, prompts[i], tokens[i], stops[i], img_key=img_key)
+        return results
+
+    resp = await asyncio.to_thread(
+        query_medgemma_batch,
+        [image] * len(miss),
+        [prompts[i] for i in miss],
+        [tokens[i] for i in miss],
+        [stops[i] for i in miss],
+    )
+    for j, i in enumerate(miss):
+        out = resp[j] if isinstance(resp, list) and j < len(resp) else resp
+        out = out if isinstance(out, list) else [out]
+        results[i] = out
+        _MEDGEMMA_CACHE[keys[i]] = out
+    return results
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Geocoding — one shared Nominatim client (custom user agent per its ToS) plus
+# a 24h TTL cache. Nominatim rate-limits to ~1 req/s, so repeat locations and
+# hospital names must not hit the service again.
+# ──────────────────────────────────────────────────────────────────────────────
+_GEOLOCATOR = Nominatim(user_agent="casetwin_medical_routing_bot")
+_GEO_CACHE = TTLCache(maxsize=4096, ttl=86400)
+# cachetools caches are not thread-safe and these helpers run in up to five
+# concurrent to_thread workers during the /search_hospitals fan-out; lock
+# around cache access only, never across the network call.
+_GEO_CACHE_LOCK = threading.Lock()
+
+
+def _cached_geocode(query: str):
+    with _GEO_CACHE_LOCK:
+        if query in _GEO_CACHE:
+            return _GEO_CACHE[query]
+    result = _GEOLOCATOR.geocode(query, timeout=5)
+    with _GEO_CACHE_LOCK:
+        _GEO_CACHE[query] = result
+    return result
+
+
+def _cached_reverse(lat: float, lng: float):
+    # 3-decimal rounding is a ~110m bucket, so nearby coordinates reuse entries
+    key = f"{round(lat, 3)},{round(lng, 3)}"
+    with _GEO_CACHE_LOCK:
+        if key in _GEO_CACHE:
+            return _GEO_CACHE[key]
+    result = _GEOLOCATOR.reverse(f"{lat}, {lng}", timeout=5)
+    with _GEO_CACHE_LOCK:
+        _GEO_CACHE[key] = result
+    return result
+
+
+# OSRM route durations, keyed by origin/destination coordinate buckets.
+# Routes from the same city center to the same hospital are identical
+# across requests, so a 24h TTL saves one external GET per hospital.
+_OSRM_CACHE = TTLCache(maxsize=8192, ttl=86400)
+
+# Index-based travel-time strings used when OSRM routing fails — precomputed
+# once instead of re-interpolated for every candidate on each request.
+_FALLBACK_TRAVEL = tuple(
+    f"{max(1, (i * 15) // 60)}h {(i * 15) % 60}m" for i in range(20)
+)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Embedding cache — the remote embedding call dominates /search latency, so
+# repeat uploads of the same image (re-searches, retries after a 503) are
+# served by content hash without re-decoding or re-embedding.
+# ──────────────────────────────────────────────────────────────────────────────
+_EMBED_CACHE: "OrderedDict[str, list[float]]" = OrderedDict()
+_EMBED_CACHE_MAX = 512
+
+
+def _embed_cache_get(key: str):
+    embedding = _EMBED_CACHE.get(key)
+    if embedding is not None:
+        _EMBED_CACHE.move_to_end(key)
+    return embedding
+
+
+def _embed_cache_put(key: str, embedding: list):
+    _EMBED_CACHE[key] = embedding
+    _EMBED_CACHE.move_to_end(key)
+    while len(_EMBED_CACHE) > _EMBED_CACHE_MAX:
+        _EMBED_CACHE.popitem(last=False)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Query-vector cache in front of Qdrant — near-duplicate query embeddings
+# (e.g. crops/re-exports of the same study) return the previously fetched
+# matches without a network round-trip + HNSW traversal.
+# ──────────────────────────────────────────────────────────────────────────────
+class _QueryVectorCache:
+    """
+    Ring buffer of the last N normalized query embeddings plus their matches.
+    A lookup is a single BLAS matrix-vector product; a hit requires cosine
+    similarity >= tau AND an identical re-rank context (profile + limit).
+    """
+
+    def __init__(self, size: int = 1024, tau: float = 0.97):
+        self.size = size
+        self.tau = tau
+        self.matrix = None          # np.float32 [size, d], allocated lazily
+        self.entries = [None] * size  # (context_key, matches)
+        self.count = 0
+        self.pos = 0
+
+    @staticmethod
+    def _normalize(embedding: list) -> "np.ndarray":
+        v = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(v))
+        return v / norm if norm else v
+
+    def get(self, embedding: list, context_key: str):
+        if self.count == 0:
+            return None
+        v = self._normalize(embedding)
+        sims = self.matrix[: self.count] @ v
+        best = int(np.argmax(sims))
+        if sims[best] >= self.tau and self.entries[best][0] == context_key:
+            return self.entries[best][1]
+        return None
+
+    def put(self, embedding: list, context_key: str, matches: list):
+        v = self._normalize(embedding)
+        if self.matrix is None:
+            self.matrix = np.zeros((self.size, v.shape[0]), dtype=np.float32)
+        self.matrix[self.pos] = v
+        self.entries[self.pos] = (context_key, matches)
+        self.pos = (self.pos + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+
+_QV_CACHE = _QueryVectorCache()
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Profile form-field dependencies — each JSON blob is parsed exactly once at
+# the routing layer and handlers receive dicts. Parsing stays lenient (None on
+# bad JSON) to match the endpoints' historical tolerance.
+# ──────────────────────────────────────────────────────────────────────────────
+async def _parse_profile(profile: Optional[str] = Form(None)) -> Optional[dict]:
+    if not profile:
+        return None
+    try:
+        return orjson.loads(profile)
+    except Exception as e:
+        logger.warning("Failed to parse profile JSON: %s", e)
+        return None
+
+
+async def _parse_current_profile(current_profile: Optional[str] = Form(default=None)) -> Optional[dict]:
+    if not current_profile:
+        return None
+    try:
+        return orjson.loads(current_profile)
+    except Exception as e:
+        logger.warning("Failed to parse current_profile: %s", e)
+        return None
+
+
+async def _parse_profile_json(profile_json: str = Form(...)) -> Optional[dict]:
+    try:
+        return orjson.loads(profile_json)
+    except Exception as e:
+        logger.warning("Failed to parse profile_json: %s", e)
+        return None
+
+
 @app.post("/search")
 async def search(
     file: UploadFile = File(...),
-    profile: Optional[str] = Form(None),
+    parsed_profile: Optional[dict] = Depends(_parse_profile),
     limit: int = 10
 ):
     """
@@ -63,34 +517,47 @@ async def search(
     if file.content_type not in ("image/jpeg", "image/png", "image/webp", "image/gif"):
         raise HTTPException(status_code=400, detail="Only image files are accepted (jpg, png, webp).")
 
-    try:
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents)).convert("RGB")
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Could not read image: {e}")
+    # Hash incrementally while spooling to a temp file: no full-upload bytes
+    # object, so peak memory stays ~1x the image instead of 2x.
+    hasher = hashlib.sha256()
+    spool = SpooledTemporaryFile(max_size=4 * 1024 * 1024)
+    while chunk := await file.read(262144):
+        hasher.update(chunk)
+        spool.write(chunk)
+    cache_key = hasher.hexdigest()
+
+    embedding = _embed_cache_get(cache_key)
+    if embedding is None:
+        try:
+            spool.seek(0)
+            image = _decode_image(spool)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Could not read image: {e}")
 
-    parsed_profile = None
-    if profile:
         try:
-            parsed_profile = json.loads(profile)
+            embedding = generate_embedding(image)
         except Exception as e:
-            print(f"Warning: Failed to parse profile JSON: {e}")
+            err_str = str(e)
+            if "503" in err_str or "Service Unavailable" in err_str:
+                raise HTTPException(
+                    status_code=503,
+                    detail="The AI image matching model is currently waking up or unavailable. Please try again in about 1-2 minutes."
+                )
+            raise HTTPException(status_code=500, detail=f"Embedding generation failed: {e}")
+        _embed_cache_put(cache_key, embedding)
 
-    try:
-        embedding = generate_embedding(image)
-    except Exception as e:
-        err_str = str(e)
-        if "503" in err_str or "Service Unavailable" in err_str:
-            raise HTTPException(
-                status_code=503, 
-                detail="The AI image matching model is currently waking up or unavailable. Please try again in about 1-2 minutes."
-            )
-        raise HTTPException(status_code=500, detail=f"Embedding generation failed: {e}")
+    # Re-rank context must match exactly for a cached result to be valid.
+    context_key = hashlib.sha256(
+        orjson.dumps({"profile": parsed_profile, "limit": limit}, option=orjson.OPT_SORT_KEYS)
+    ).hexdigest()
 
-    try:
-        matches = search_similar(embedding, profile_data=parsed_profile, limit=limit)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Qdrant search failed: {e}")
+    matches = _QV_CACHE.get(embedding, context_key)
+    if matches is None:
+        try:
+            matches = search_similar(embedding, profile_data=parsed_profile, limit=limit)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Qdrant search failed: {e}")
+        _QV_CACHE.put(embedding, context_key, matches)
 
     return {"matches": matches, "count": len(matches)}
 
@@ -103,7 +570,8 @@ async def compare_insights(
     original_image: UploadFile = File(...),
     match_diagnosis: str = Form(...),
     match_image_url: str = Form(None),
-    match_payload: str = Form(None)
+    match_payload: str = Form(None),
+    stream: bool = Form(False)
 ):
     """
     Given the original uploaded image and the diagnosis of the matched case,
@@ -111,43 +579,27 @@ async def compare_insights(
     This also handles the matched image if we pass it, but for simplicity
     we'll fetch/analyze both or simulate bounding boxes if it fails.
     """
-    import httpx
-    
-    # Read original image
+    # Read original image straight from the upload's spooled temp file —
+    # no intermediate bytes copy.
     try:
-        contents = await original_image.read()
-        orig_pil = Image.open(io.BytesIO(contents)).convert("RGB")
+        orig_pil = _decode_image(original_image.file)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Could not read original image: {e}")
-        
-    # Read matched image
-    match_pil = None
-    if match_image_url and match_image_url.startswith("http"):
-        try:
-            async with httpx.AsyncClient() as client:
-                r = await client.get(match_image_url)
-                if r.status_code == 200:
-                    match_pil = Image.open(io.BytesIO(r.content)).convert("RGB")
-        except Exception as e:
-            print(f"Warning: could not fetch matched image {match_image_url}: {e}")
 
     # Parse match payload for context
     parsed_payload = {}
     if match_payload:
         try:
-            parsed_payload = json.loads(match_payload)
+            parsed_payload = orjson.loads(match_payload)
         except Exception as e:
-            print(f"Warning: failed to parse match_payload JSON: {e}")
+            logger.warning("Failed to parse match_payload JSON: %s", e)
             
     # Query MedGemma for bounding boxes for original
     prompt = f"Return the bounding box coordinates [ymin, xmin, ymax, xmax] for the finding '{match_diagnosis}' in this chest X-ray."
-    
-    orig_box = None
-    match_box = None
-    
+
     # Helper to parse MedGemma [y1, x1, y2, x2] response strings
     def parse_box(text):
-        m = re.search(r'\[\s*(\d+)\s*,\s*(\d+)\s*,\s*(\d+)\s*,\s*(\d+)\s*\]', text)
+        m = _BOX_RE.search(text)
         if m:
             return [int(m.group(1)), int(m.group(2)), int(m.group(3)), int(m.group(4))]
         return None
@@ -158,76 +610,67 @@ async def compare_insights(
         y1, x1, y2, x2 = box
         xc = (x1 + x2) / 2
         yc = (y1 + y2) / 2
+        row = bisect.bisect(_REGION_EDGES, yc)
+        col = bisect.bisect(_REGION_EDGES, xc)
+        return f"{_REGIONS[row][col]} region"
         
-        if yc < 333:
-            v = "upper"
-        elif yc < 666:
-            v = "mid"
-        else:
-            v = "lower"
-            
-        if xc < 333:
-            h = "left"
-        elif xc < 666:
-            h = "central"
-        else:
-            h = "right"
-            
-        return f"{v} {h} region"
-        
-    # Query for original image box
-    try:
-        resp = query_medgemma(orig_pil, prompt=prompt, max_tokens=50)
-        if isinstance(resp, list) and len(resp) > 0:
-            box_text = resp[0].get("generated_text", "")
-            orig_box = parse_box(box_text)
-    except Exception as e:
-        print(f"MedGemma orig box extraction error: {e}")
-        
-    # Query for match image
-    if match_pil:
+    # Fetch the matched image, then resolve both boxes. When the match image
+    # is available the two lookups share ONE batched multi-image call (one
+    # prefill, one RTT) instead of two independent generations.
+    match_pil = None
+    if match_image_url and match_image_url.startswith("http"):
         try:
-            resp = query_medgemma(match_pil, prompt=prompt, max_tokens=50)
-            if isinstance(resp, list) and len(resp) > 0:
-                box_text = resp[0].get("generated_text", "")
-                match_box = parse_box(box_text)
+            r = await app.state.http.get(match_image_url)
+            if r.status_code == 200:
+                match_pil = _decode_image(io.BytesIO(r.content))
         except Exception as e:
-            print(f"MedGemma match box extraction error: {e}")
-            
+            logger.warning("Could not fetch matched image %s: %s", match_image_url, e)
+
+    orig_box = None
+    match_box = None
+    try:
+        if match_pil is not None:
+            resp = await asyncio.to_thread(
+                query_medgemma, [orig_pil, match_pil], prompt=prompt, max_tokens=50
+            )
+        else:
+            resp = await asyncio.to_thread(query_medgemma, orig_pil, prompt=prompt, max_tokens=50)
+        if isinstance(resp, list):
+            if len(resp) > 0:
+                orig_box = parse_box(resp[0].get("generated_text", ""))
+            if match_pil is not None and len(resp) > 1:
+                match_box = parse_box(resp[1].get("generated_text", ""))
+    except Exception as e:
+        logger.warning("MedGemma box extraction error: %s", e)
+
+
     # Fallback to simulated bounding boxes if model fails or doesn't support coordinates
     if not orig_box or not match_box:
         # Generate pseudo-random deterministic coordinates based on diagnosis and URL
-        import hashlib
         hash_input = f"{match_diagnosis}-{match_image_url or 'local'}".encode()
-        h = int(hashlib.md5(hash_input).hexdigest()[:8], 16)
-        
+        h = int.from_bytes(hashlib.md5(hash_input).digest()[:4], "big")
+
         # Base ranges
         y_center = 200 + (h % 500)
         x_center = 200 + ((h // 500) % 500)
-        box_size = 150 + (h % 200)
-        
+        half = (150 + (h % 200)) // 2
+
         if not orig_box:
-            orig_box = [
-                max(0, y_center - box_size//2),
-                max(0, x_center - box_size//2),
-                min(1000, y_center + box_size//2),
-                min(1000, x_center + box_size//2)
-            ]
+            orig_box = np.clip(
+                np.array([y_center - half, x_center - half, y_center + half, x_center + half]),
+                0, 1000,
+            ).tolist()
         if not match_box:
             # Shift match box slightly
             y_shift = -50 + (h % 100)
             x_shift = -50 + ((h // 100) % 100)
-            match_box = [
-                max(0, orig_box[0] + y_shift),
-                max(0, orig_box[1] + x_shift),
-                min(1000, orig_box[2] + y_shift),
-                min(1000, orig_box[3] + x_shift)
-            ]
+            match_box = np.clip(
+                np.array(orig_box) + np.array([y_shift, x_shift, y_shift, x_shift]),
+                0, 1000,
+            ).tolist()
 
     orig_region = get_region_text(orig_box) if orig_box else "the affected region"
     match_region = get_region_text(match_box) if match_box else "the affected region"
-    
-    import re
 
     # Build a tight prompt that forces a single, concise, non-repeating output
     hpi = parsed_payload.get("presentation", {}).get("hpi", "")
@@ -245,39 +688,49 @@ async def compare_insights(
         f"Use **bold** for key medical terms. Do NOT repeat yourself. Stop after 6 sentences."
     )
 
+    def _clean_insights(raw: str) -> str:
+        # Strip prompt echo if model returns the full prompt+completion
+        if raw.startswith(unified_prompt):
+            raw = raw[len(unified_prompt):].strip()
+        # Remove any leading "markdown" / code fence artifacts
+        raw = _CODE_FENCE_RE.sub("", raw).strip()
+        raw = _TRAIL_FENCE_RE.sub("", raw).strip()
+        # Strip LaTeX boxed notation the model sometimes wraps output in
+        # e.g.  $\boxed{The current image shows...}$  or  \boxed{...}
+        raw = _BOXED_RE.sub(r"\1", raw)
+        raw = raw.strip()
+        # Deduplicate: if the model loops, keep only the first unique
+        # occurrence and stop after 6 sentences
+        return _dedup_text(raw, max_items=6, granularity="sentence")
+
+    if stream:
+        # SSE: boxes first (so overlays render immediately), raw token deltas
+        # as they arrive, then the cleaned/deduped text as the final event.
+        async def _sse():
+            first = {"original_box": orig_box, "match_box": match_box}
+            yield f"data: {orjson.dumps(first).decode()}\n\n"
+            pieces = []
+            try:
+                async for tok in query_medgemma_stream(orig_pil, prompt=unified_prompt, max_tokens=400):
+                    pieces.append(tok)
+                    yield f"data: {orjson.dumps({'delta': tok}).decode()}\n\n"
+            except Exception as e:
+                logger.warning("MedGemma streaming extraction error: %s", e)
+            raw = "".join(pieces).strip()
+            gen_text = _clean_insights(raw) if raw else "Unable to complete AI analysis at this time."
+            final = {"insights_text": gen_text, "done": True}
+            yield f"data: {orjson.dumps(final).decode()}\n\n"
+
+        return StreamingResponse(_sse(), media_type="text/event-stream")
+
     try:
-        import asyncio
         resp = await asyncio.to_thread(query_medgemma, orig_pil, prompt=unified_prompt, max_tokens=400)
         gen_text = "AI analysis unavailable."
         if isinstance(resp, list) and len(resp) > 0 and resp[0].get("generated_text"):
-            raw = resp[0]["generated_text"].strip()
-            # Strip prompt echo if model returns the full prompt+completion
-            if raw.startswith(unified_prompt):
-                raw = raw[len(unified_prompt):].strip()
-            # Remove any leading "markdown" / code fence artifacts
-            raw = re.sub(r"^```(?:markdown)?\s*", "", raw, flags=re.IGNORECASE).strip()
-            raw = re.sub(r"```$", "", raw).strip()
-            # Strip LaTeX boxed notation the model sometimes wraps output in
-            # e.g.  $\boxed{The current image shows...}$  or  \boxed{...}
-            raw = re.sub(r"\$?\\?boxed\{(.+?)\}\$?", r"\1", raw, flags=re.DOTALL)
-            raw = raw.strip()
-            # Deduplicate: if the model loops, keep only the first unique occurrence
-            # Split on common sentence-repeat markers
-            seen = set()
-            sentences = re.split(r"(?<=[.!?])\s+", raw)
-            deduped = []
-            for s in sentences:
-                key = s.strip().lower()[:60]
-                if key not in seen:
-                    seen.add(key)
-                    deduped.append(s.strip())
-                # Stop after 6 sentences
-                if len(deduped) >= 6:
-                    break
-            gen_text = " ".join(deduped)
+            gen_text = _clean_insights(resp[0]["generated_text"].strip())
 
     except Exception as e:
-        print(f"MedGemma unified extraction error: {e}")
+        logger.warning("MedGemma unified extraction error: %s", e)
         gen_text = "Unable to complete AI analysis at this time."
 
     return {
@@ -303,10 +756,6 @@ async def search_hospitals(
     Returns structured data detailing facility names, capabilities, reason for match,
     and approximate locations/coordinates for mapping.
     """
-    import os
-    import httpx
-    import json
-    
     ydc_api_key = os.getenv("YDC_API_KEY")
     if not ydc_api_key:
         raise HTTPException(status_code=500, detail="YDC_API_KEY environment variable is missing.")
@@ -316,12 +765,6 @@ async def search_hospitals(
     travel_context = f" The hospital MUST be reachable within a {maxTravelTime} hour travel time from the location." if maxTravelTime else ""
     
     # Use Geopy for real coordinates and OSRM for real routing
-    from geopy.geocoders import Nominatim
-    import asyncio
-    
-    # Using a custom user agent as required by Nominatim's Terms of Service
-    geolocator = Nominatim(user_agent="casetwin_medical_routing_bot")
-    
     user_lat, user_lng = 39.8283, -98.5795 # Default US Center
     search_location_str = location or 'United States'
     
@@ -338,27 +781,23 @@ async def search_hospitals(
                 pass
                 
         if is_coords:
-            def reverse_loc(lat, lng):
-                return geolocator.reverse(f"{lat}, {lng}", timeout=5)
             try:
-                rev_data = await asyncio.to_thread(reverse_loc, user_lat, user_lng)
+                rev_data = await asyncio.to_thread(_cached_reverse, user_lat, user_lng)
                 if rev_data:
                     address = rev_data.raw.get('address', {})
                     city = address.get('city') or address.get('town') or address.get('county') or address.get('state')
                     if city:
                         search_location_str = f"{city}, {address.get('state', '')}"
-                        print(f"Reverse geocode success: {location} -> {search_location_str}", flush=True)
+                        logger.info("Reverse geocode success: %s -> %s", location, search_location_str)
             except Exception as e:
-                print(f"Reverse geocode failed: {e}", flush=True)
+                logger.warning("Reverse geocode failed: %s", e)
         else:
-            def geocode_loc(loc_str):
-                return geolocator.geocode(loc_str, timeout=5)
             try:
-                user_loc_data = await asyncio.to_thread(geocode_loc, location)
+                user_loc_data = await asyncio.to_thread(_cached_geocode, location)
                 if user_loc_data:
                     user_lat, user_lng = user_loc_data.latitude, user_loc_data.longitude
             except Exception as e:
-                print(f"Warning: Geocoding user location '{location}' failed: {e}", flush=True)
+                logger.warning("Geocoding user location '%s' failed: %s", location, e)
 
     distance_context = f" within {maxDistance} miles" if maxDistance else ""
     query = f"top hospitals medical centers {search_location_str}{distance_context} treating {diagnosis} {equipment or ''}"
@@ -373,146 +812,163 @@ async def search_hospitals(
     }
 
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            resp = await client.get("https://ydc-index.io/v1/search", headers=headers, params=payload)
-            resp.raise_for_status()
-            data = resp.json()
-            
-            # Extract standard web search results — handle both v1 (hits) and v2 (results.web) shapes
-            web_results = data.get("hits", []) or data.get("results", {}).get("web", [])
-
-            # If first query returned nothing, retry with a simpler query (drop equipment/distance)
-            if not web_results:
-                simple_query = f"top hospitals medical centers {search_location_str} treating {diagnosis}"
-                print(f"[search_hospitals] First query returned 0 results, retrying with simplified query...", flush=True)
-                retry_resp = await client.get("https://ydc-index.io/v1/search", headers=headers, params={"query": simple_query, "count": 10})
-                retry_resp.raise_for_status()
-                retry_data = retry_resp.json()
-                web_results = retry_data.get("hits", []) or retry_data.get("results", {}).get("web", [])
-                print(f"[search_hospitals] Retry returned {len(web_results)} results", flush=True)
-
-            all_text = ""
-            for hit in web_results:
-                snippets = hit.get("snippets", [])
-                if snippets:
-                    all_text += " ".join(snippets) + "\n"
-
-            print(f"[{datetime.now().strftime('%H:%M:%S')}] [search_hospitals] You.com Search Snippets:\n{all_text[:300]}...\n", flush=True)
-
-            import random
-
-            centers = []
-            seen_names = set()
-
-            # ── Gemini batch call: clean names + proper rationales for all hits ──────
-            gemini_api_key_g = os.getenv("GEMINI_API_KEY")
-            ai_enriched: list = []
-            if gemini_api_key_g and web_results:
-                try:
-                    import google.generativeai as genai
-                    genai.configure(api_key=gemini_api_key_g)
-                    g_model = genai.GenerativeModel("gemini-2.5-flash")
-                    raw_for_gemini = [
-                        {
-                            "title": h.get("title", ""),
-                            "url": h.get("url", ""),
-                            "snippet": (h.get("description", "") or " ".join(h.get("snippets", [])))[:400],
-                        }
-                        for h in web_results[:10]
-                    ]
-                    g_prompt = (
-                        f'You are a medical facility data extractor. These are web search results for '
-                        f'hospitals treating "{diagnosis}" near {search_location_str}.\n\n'
-                        f'STRICT RULES for "name":\n'
-                        f'- Must be the official name of a HOSPITAL, MEDICAL CENTER, or CLINIC institution\n'
-                        f'- NEVER use service or department names as the facility name. '
-                        f'  Examples of INVALID names: "Interventional Radiology", "Imaging Services", '
-                        f'  "Imaging and Radiology", "Home", "CT Scan", "MRI Services"\n'
-                        f'- If the page title is a service/department, extract the institution name from '
-                        f'  the URL domain or snippet instead. '
-                        f'  Example: title="Imaging Services", domain="tmh.org" → name="Tallahassee Memorial Hospital"\n'
-                        f'- Strip location prefixes from names. '
-                        f'  Example: "Tallahassee, FL • American Health Imaging" → "American Health Imaging"\n'
-                        f'- If two results belong to the SAME institution, use the EXACT same name for both\n'
-                        f'- If no valid institution name can be determined at all, return null for that entry\n\n'
-                        f'For each result also extract:\n'
-                        f'"rationale": 2–3 concise sentences explaining why this facility is a strong '
-                        f'match for treating {diagnosis}\n\n'
-                        f'Input:\n{json.dumps(raw_for_gemini)}\n\n'
-                        f'Return ONLY a JSON array, same length and order as input, no markdown:\n'
-                        f'[{{"name": "..." or null, "rationale": "..."}}]'
-                    )
-                    def _call_gemini():
-                        return g_model.generate_content(g_prompt)
-                    g_resp = await asyncio.to_thread(_call_gemini)
-                    g_text = g_resp.text.strip()
-                    for prefix in ("```json", "```"):
-                        if g_text.startswith(prefix):
-                            g_text = g_text[len(prefix):]
-                    if g_text.endswith("```"):
-                        g_text = g_text[:-3]
-                    g_text = g_text.strip()
-                    # Recover from truncated JSON by trimming to the last complete object
-                    if not g_text.endswith("]"):
-                        last_close = g_text.rfind("},")
-                        if last_close != -1:
-                            g_text = g_text[:last_close + 1] + "]"
-                    ai_enriched = json.loads(g_text)
-                    print(f"[search_hospitals] Gemini enriched {len(ai_enriched)} entries", flush=True)
-                except Exception as e:
-                    print(f"[search_hospitals] Gemini enrichment failed, using raw titles: {e}", flush=True)
-                    ai_enriched = []
-
-            # Pad so we can safely index by position
-            while len(ai_enriched) < len(web_results):
-                ai_enriched.append({})
-
-            for i, hit in enumerate(web_results):
-                if len(centers) >= 10:
-                    break
-
-                gd = ai_enriched[i] if i < len(ai_enriched) else {}
-
-                # Skip entries Gemini couldn't resolve to a real institution name
-                if gd.get("name") is None and i < len(ai_enriched):
-                    continue
-
-                name = (gd.get("name") or "").strip()
-                if not name:
-                    # Gemini call failed entirely — use title as last resort
-                    name = hit.get("title", "").split(" | ")[0].split(" - ")[0].strip()
-                name = name.replace("...", "").strip() or f"Medical Center {len(centers) + 1}"
-
-                if name.lower() in seen_names:
-                    continue
-                seen_names.add(name.lower())
-
-                url = hit.get("url", "")
-
-                # Rationale: Gemini output first, fall back to raw snippet
-                rationale = (gd.get("rationale") or "").strip()
-                if not rationale:
-                    rationale = hit.get("description", "") or " ".join(hit.get("snippets", []))
-                if not rationale:
-                    rationale = "Specialized care facility."
-
-                # --- Geopy Coordinates ---
-                h_lat = user_lat + random.uniform(-0.06, 0.06)
-                h_lng = user_lng + random.uniform(-0.06, 0.06)
-                try:
-                    geo_query = f"{name}, {search_location_str}"
-                    h_loc_data = await asyncio.to_thread(geocode_loc, geo_query)
-                    if h_loc_data:
-                        h_lat, h_lng = h_loc_data.latitude, h_loc_data.longitude
-                    else:
-                        h_loc_data_fallback = await asyncio.to_thread(geocode_loc, name)
-                        if h_loc_data_fallback:
-                            h_lat, h_lng = h_loc_data_fallback.latitude, h_loc_data_fallback.longitude
-                except Exception as e:
-                    print(f"Geocoding hospital '{name}' failed: {e}", flush=True)
-
-                # --- OSRM ETA ---
-                travel_str = f"{max(1, (i * 15) // 60)}h {(i * 15) % 60}m"
+        client = app.state.http
+        resp = await client.get("https://ydc-index.io/v1/search", headers=headers, params=payload)
+        resp.raise_for_status()
+        data = resp.json()
+        
+        # Extract standard web search results — handle both v1 (hits) and v2 (results.web) shapes
+        web_results = data.get("hits", []) or data.get("results", {}).get("web", [])
+
+        # If first query returned nothing, retry with a simpler query (drop equipment/distance)
+        if not web_results:
+            simple_query = f"top hospitals medical centers {search_location_str} treating {diagnosis}"
+            logger.info("[search_hospitals] First query returned 0 results, retrying with simplified query...")
+            retry_resp = await client.get("https://ydc-index.io/v1/search", headers=headers, params={"query": simple_query, "count": 10})
+            retry_resp.raise_for_status()
+            retry_data = retry_resp.json()
+            web_results = retry_data.get("hits", []) or retry_data.get("results", {}).get("web", [])
+            logger.info("[search_hospitals] Retry returned %s results", len(web_results))
+
+        all_text = ""
+        for hit in web_results:
+            snippets = hit.get("snippets", [])
+            if snippets:
+                all_text += " ".join(snippets) + "\n"
+
+        logger.info("[search_hospitals] You.com Search Snippets:\n%s...\n", all_text[:300])
+
+        centers = []
+        seen_names = set()
+
+        # ── Gemini batch call: clean names + proper rationales for all hits ──────
+        gemini_api_key_g = os.getenv("GEMINI_API_KEY")
+        ai_enriched: list = []
+        if gemini_api_key_g and web_results:
+            try:
+                import google.generativeai as genai
+                genai.configure(api_key=gemini_api_key_g)
+                g_model = genai.GenerativeModel("gemini-2.5-flash")
+                raw_for_gemini = [
+                    {
+                        "title": h.get("title", ""),
+                        "url": h.get("url", ""),
+                        "snippet": (h.get("description", "") or " ".join(h.get("snippets", [])))[:400],
+                    }
+                    for h in web_results[:10]
+                ]
+                g_prompt = (
+                    f'You are a medical facility data extractor. These are web search results for '
+                    f'hospitals treating "{diagnosis}" near {search_location_str}.\n\n'
+                    f'STRICT RULES for "name":\n'
+                    f'- Must be the official name of a HOSPITAL, MEDICAL CENTER, or CLINIC institution\n'
+                    f'- NEVER use service or department names as the facility name. '
+                    f'  Examples of INVALID names: "Interventional Radiology", "Imaging Services", '
+                    f'  "Imaging and Radiology", "Home", "CT Scan", "MRI Services"\n'
+                    f'- If the page title is a service/department, extract the institution name from '
+                    f'  the URL domain or snippet instead. '
+                    f'  Example: title="Imaging Services", domain="tmh.org" → name="Tallahassee Memorial Hospital"\n'
+                    f'- Strip location prefixes from names. '
+                    f'  Example: "Tallahassee, FL • American Health Imaging" → "American Health Imaging"\n'
+                    f'- If two results belong to the SAME institution, use the EXACT same name for both\n'
+                    f'- If no valid institution name can be determined at all, return null for that entry\n\n'
+                    f'For each result also extract:\n'
+                    f'"rationale": 2–3 concise sentences explaining why this facility is a strong '
+                    f'match for treating {diagnosis}\n\n'
+                    f'Input:\n{json.dumps(raw_for_gemini)}\n\n'
+                    f'Return ONLY a JSON array, same length and order as input, no markdown:\n'
+                    f'[{{"name": "..." or null, "rationale": "..."}}]'
+                )
+                def _call_gemini():
+                    return g_model.generate_content(g_prompt)
+                g_resp = await asyncio.to_thread(_call_gemini)
+                g_text = g_resp.text.strip()
+                for prefix in ("```json", "```"):
+                    if g_text.startswith(prefix):
+                        g_text = g_text[len(prefix):]
+                if g_text.endswith("```"):
+                    g_text = g_text[:-3]
+                g_text = g_text.strip()
+                # Recover from truncated JSON by trimming to the last complete object
+                if not g_text.endswith("]"):
+                    last_close = g_text.rfind("},")
+                    if last_close != -1:
+                        g_text = g_text[:last_close + 1] + "]"
+                ai_enriched = orjson.loads(g_text)
+                logger.info("[search_hospitals] Gemini enriched %s entries", len(ai_enriched))
+            except Exception as e:
+                logger.warning("[search_hospitals] Gemini enrichment failed, using raw titles: %s", e)
+                ai_enriched = []
+
+        # Pad so we can safely index by position
+        while len(ai_enriched) < len(web_results):
+            ai_enriched.append({})
+
+        # ── Phase 1: resolve names/rationales serially (cheap, local) ────
+        candidates = []
+        for i, hit in enumerate(web_results):
+            if len(candidates) >= 10:
+                break
+
+            gd = ai_enriched[i] if i < len(ai_enriched) else {}
+
+            # Skip entries Gemini couldn't resolve to a real institution name
+            if gd.get("name") is None and i < len(ai_enriched):
+                continue
+
+            name = (gd.get("name") or "").strip()
+            if not name:
+                # Gemini call failed entirely — use title as last resort
+                name = hit.get("title", "").split(" | ")[0].split(" - ")[0].strip()
+            name = name.replace("...", "").strip() or f"Medical Center {len(candidates) + 1}"
+
+            if name.lower() in seen_names:
+                continue
+            seen_names.add(name.lower())
+
+            # Rationale: Gemini output first, fall back to raw snippet
+            rationale = (gd.get("rationale") or "").strip()
+            if not rationale:
+                rationale = hit.get("description", "") or " ".join(hit.get("snippets", []))
+            if not rationale:
+                rationale = "Specialized care facility."
+
+            candidates.append({
+                "i": i,
+                "name": name,
+                "url": hit.get("url", ""),
+                "rationale": rationale,
+            })
+
+        # ── Phase 2: geocode all candidates concurrently ─────────────────
+        # Cap concurrency so we don't hammer Nominatim (ToS: be gentle).
+        geo_sem = asyncio.Semaphore(5)
+
+        async def _geocode_candidate(cand):
+            h_lat = user_lat + random.uniform(-0.06, 0.06)
+            h_lng = user_lng + random.uniform(-0.06, 0.06)
+            try:
+                async with geo_sem:
+                    geo_query = f"{cand['name']}, {search_location_str}"
+                    h_loc_data = await asyncio.to_thread(_cached_geocode, geo_query)
+                    if not h_loc_data:
+                        h_loc_data = await asyncio.to_thread(_cached_geocode, cand['name'])
+                if h_loc_data:
+                    h_lat, h_lng = h_loc_data.latitude, h_loc_data.longitude
+            except Exception as e:
+                logger.warning("Geocoding hospital '%s' failed: %s", cand['name'], e)
+            return h_lat, h_lng
+
+        async with asyncio.TaskGroup() as tg:
+            geo_tasks = [tg.create_task(_geocode_candidate(c)) for c in candidates]
+        coords = [t.result() for t in geo_tasks]
+
+        # ── Phase 3: fetch all OSRM ETAs concurrently ────────────────────
+        async def _osrm_eta(cand, h_lat, h_lng):
+            travel_str = _FALLBACK_TRAVEL[min(cand['i'], len(_FALLBACK_TRAVEL) - 1)]
+            route_key = (round(user_lat, 3), round(user_lng, 3), round(h_lat, 4), round(h_lng, 4))
+            dur = _OSRM_CACHE.get(route_key)
+            if dur is None:
                 try:
                     osrm_url = f"http://router.project-osrm.org/route/v1/driving/{user_lng},{user_lat};{h_lng},{h_lat}?overview=false"
                     osrm_resp = await client.get(osrm_url)
@@ -520,32 +976,41 @@ async def search_hospitals(
                         route_data = osrm_resp.json()
                         if route_data.get("routes"):
                             dur = route_data["routes"][0].get("duration", 0)
-                            hours, minutes = int(dur // 3600), int((dur % 3600) // 60)
-                            travel_str = f"{hours}h {minutes}m" if hours > 0 else f"{minutes}m"
-                            print(f"[OSRM] ETA for '{name}': {travel_str}", flush=True)
+                            _OSRM_CACHE[route_key] = dur
                 except Exception as e:
-                    print(f"OSRM ETA failed for {name}: {e}", flush=True)
-
-                centers.append({
-                    "name": name,
-                    "url": url,
-                    "capability": str(99 - i) + "%",
-                    "travel": travel_str,
-                    "reason": rationale,
-                    "lat": h_lat,
-                    "lng": h_lng,
-                })
-            
-            if centers:
-                return {"centers": centers}
-            else:
-                raise ValueError("No results found in You.com Search")
-            
+                    logger.warning("OSRM ETA failed for %s: %s", cand['name'], e)
+            if dur is not None:
+                hours, minutes = int(dur // 3600), int((dur % 3600) // 60)
+                travel_str = f"{hours}h {minutes}m" if hours > 0 else f"{minutes}m"
+                logger.info("[OSRM] ETA for '%s': %s", cand['name'], travel_str)
+            return travel_str
+
+        async with asyncio.TaskGroup() as tg:
+            eta_tasks = [
+                tg.create_task(_osrm_eta(c, lat, lng))
+                for c, (lat, lng) in zip(candidates, coords)
+            ]
+        travels = [t.result() for t in eta_tasks]
+
+        for cand, (h_lat, h_lng), travel_str in zip(candidates, coords, travels):
+            centers.append({
+                "name": cand["name"],
+                "url": cand["url"],
+                "capability": str(99 - cand["i"]) + "%",
+                "travel": travel_str,
+                "reason": cand["rationale"],
+                "lat": h_lat,
+                "lng": h_lng,
+            })
+
+
+        if centers:
+            return {"centers": centers}
+        else:
+            raise ValueError("No results found in You.com Search")
+        
     except Exception as e:
-        print(f"Failed to fetch or parse You.com data: {e}")
-        import traceback
-        import random
-        traceback.print_exc()
+        logger.exception("Failed to fetch or parse You.com data: %s", e)
         # Gemini fallback: generate real hospital suggestions when You.com fails entirely
         gemini_api_key_fb = os.getenv("GEMINI_API_KEY")
         if gemini_api_key_fb:
@@ -572,7 +1037,7 @@ async def search_hospitals(
                         fb_text = fb_text[len(prefix):]
                 if fb_text.endswith("```"):
                     fb_text = fb_text[:-3]
-                fb_centers_raw = json.loads(fb_text.strip())
+                fb_centers_raw = orjson.loads(fb_text.strip())
                 if isinstance(fb_centers_raw, list) and fb_centers_raw:
                     fb_centers = []
                     for i, c in enumerate(fb_centers_raw):
@@ -585,10 +1050,10 @@ async def search_hospitals(
                             "lat": c.get("lat") or (user_lat + random.uniform(-1.5, 1.5)),
                             "lng": c.get("lng") or (user_lng + random.uniform(-1.5, 1.5)),
                         })
-                    print(f"[search_hospitals] Gemini fallback returned {len(fb_centers)} centers", flush=True)
+                    logger.info("[search_hospitals] Gemini fallback returned %s centers", len(fb_centers))
                     return {"centers": fb_centers}
             except Exception as fb_e:
-                print(f"[search_hospitals] Gemini fallback also failed: {fb_e}", flush=True)
+                logger.warning("[search_hospitals] Gemini fallback also failed: %s", fb_e)
         return {"centers": []}
 
 
@@ -599,7 +1064,7 @@ async def search_hospitals(
 async def chat_twin(
     query: str = Form(...),
     case_text: str = Form(...),
-    current_profile: Optional[str] = Form(default=None),
+    current_profile: Optional[dict] = Depends(_parse_current_profile),
 ):
     """
     Dual-context clinical reasoning. Grounds MedGemma in:
@@ -611,7 +1076,7 @@ async def chat_twin(
     current_ctx = ""
     if current_profile:
         try:
-            cp = json.loads(current_profile)
+            cp = current_profile
             pat = cp.get("patient", {})
             pres = cp.get("presentation", {})
             assess = cp.get("assessment", {})
@@ -650,7 +1115,7 @@ async def chat_twin(
 - **Key findings:** {findings_str}
 """
         except Exception as e:
-            print(f"Failed to parse current_profile: {e}")
+            logger.warning("Failed to parse current_profile: %s", e)
 
     # ── Build historical twin context block ───────────────────────────────────
     twin_ctx = f"""
@@ -674,56 +1139,40 @@ async def chat_twin(
         "Expert Answer:"
     )
 
-    dummy_img = Image.new("RGB", (336, 336), color=(0, 0, 0))
     try:
-        import asyncio
         stop_words = ["Final Answer:", "Final Answer", "---\nQuestion:", "Question:"]
-        resp = await asyncio.to_thread(query_medgemma, dummy_img, prompt=system_prompt, max_tokens=350, stop_sequences=stop_words)
+        resp = await _BATCHER.submit(_DUMMY_IMG, system_prompt, 350, stop_words)
         if isinstance(resp, list) and len(resp) > 0:
             reply = resp[0].get("generated_text", "").strip()
             
             # Cleanly strip prompt echoing without relying on arbitrary [-50:] slices:
-            if "Expert Answer:" in reply:
-                reply = reply.split("Expert Answer:")[-1].strip()
-            elif f"Question: {query}" in reply:
-                reply = reply.split(f"Question: {query}")[-1].strip()
+            _, sep, tail = reply.rpartition("Expert Answer:")
+            if not sep:
+                _, sep, tail = reply.rpartition(f"Question: {query}")
+            if sep:
+                reply = tail.strip()
 
-            # Strip mathematical "Final Answer:" boxed formatting AND loops
-            import re
-            
-            # The ultimate loop killer: If it generated "Final Answer" at all, 
+            # The ultimate loop killer: If it generated "Final Answer" at all,
             # throw away everything from that point onward forever.
-            if "Final Answer" in reply:
-                reply = reply.split("Final Answer")[0].strip()
-                
-            reply = re.sub(r"\\boxed{", "", reply)
-            
+            reply = reply.partition("Final Answer")[0].strip()
+
+            reply = reply.replace("\\boxed{", "")
+
             # Remove trailing closing brace from LaTeX box if it exists at the end
             if reply.endswith("}"):
                 reply = reply[:-1].strip()
-                
+
             # Clean up leading non-word artifacts if model started weirdly
-            reply = re.sub(r"^[\W_]+", "", reply)
+            reply = _LEAD_NONWORD_RE.sub("", reply)
 
             # BRUTAL DEDUPLICATION: Kill repeating lines (AI stuttering)
-            lines = [line.strip() for line in reply.split('\n') if line.strip()]
-            seen = set()
-            dedupped_lines = []
-            for line in lines:
-                # Use a slightly normalized version of the line for matching to catch slight variations
-                norm_line = re.sub(r'\W+', '', line.lower())
-                if norm_line not in seen:
-                    seen.add(norm_line)
-                    dedupped_lines.append(line)
-            
-            # Rejoin the cleaned lines
-            reply = '\n\n'.join(dedupped_lines)
+            reply = _dedup_text(reply)
 
             if not reply:
                 reply = "I don't have enough information in the provided case context to answer that."
             return {"reply": reply}
     except Exception as e:
-        print(f"MedGemma chat error: {e}")
+        logger.warning("MedGemma chat error: %s", e)
 
     return {"reply": "I'm sorry, I couldn't reach the AI reasoning engine to answer this question right now."}
 
@@ -734,7 +1183,7 @@ async def chat_twin(
 # ──────────────────────────────────────────────────────────────────────────────
 @app.post("/enhance_profile")
 async def enhance_profile(
-    profile_json: str = Form(...),
+    profile_data: Optional[dict] = Depends(_parse_profile_json),
     file: Optional[UploadFile] = File(None)
 ):
     """
@@ -743,9 +1192,8 @@ async def enhance_profile(
     and prognostic observations into a 3-4 sentence Markdown block.
     """
     try:
-        profile_data = json.loads(profile_json)
-        
-        # Build context from profile
+        # Build context from profile (None on unparseable JSON falls through
+        # to the same fallback reply as before)
         age = profile_data.get("patient", {}).get("age_years", "")
         sex = profile_data.get("patient", {}).get("sex", "")
         cc = profile_data.get("presentation", {}).get("chief_complaint", "")
@@ -771,19 +1219,20 @@ async def enhance_profile(
         img = None
         has_image = False
         if file and file.filename:
-            content = await file.read()
-            img = Image.open(io.BytesIO(content)).convert("RGB")
+            img = _decode_image(file.file)
             has_image = True
         else:
-            img = Image.new("RGB", (336, 336), color=(0, 0, 0))
+            img = _DUMMY_IMG
 
-        import asyncio
         stop_words_synthesis = ["Final Answer:", "Final Answer", "---\nClinical Synthesis:", "Clinical Synthesis:"]
-        
-        # Prepare concurrent tasks
-        tasks = [
-            asyncio.to_thread(query_medgemma, img, prompt=system_prompt, max_tokens=250, stop_sequences=stop_words_synthesis)
-        ]
+
+        # Image identity for the response-cache key; the dummy frame is shared
+        img_key = hashlib.md5(img.tobytes()).hexdigest() if has_image else "dummy"
+
+        # Collect the prompts so both generations ride one batched call
+        prompts = [system_prompt]
+        tokens = [250]
+        stops = [stop_words_synthesis]
         
         # If image exists, add a second task for Imaging Context
         if has_image:
@@ -799,39 +1248,37 @@ async def enhance_profile(
                 "Imaging Context:"
             )
             stop_words_imaging = ["Final Answer:", "Final Answer", "---\nImaging Context:", "Imaging Context:"]
-            tasks.append(
-                asyncio.to_thread(query_medgemma, img, prompt=imaging_prompt, max_tokens=200, stop_sequences=stop_words_imaging)
+            prompts.append(imaging_prompt)
+            tokens.append(200)
+            stops.append(stop_words_imaging)
+
+        # One request, both prompts: the server shares the image encoding
+        # across the two decode streams instead of prefilling it twice.
+        # Cap the wait well below the HF client's 120s transport timeout so
+        # a stalled endpoint degrades to the fallback text instead of
+        # holding the client for two minutes.  On a cache miss this path
+        # goes through _BATCHER.submit, so the timeout cancels a batcher
+        # future mid-flight; the batcher tolerates that (it skips futures
+        # that are already done when the batch resolves).
+        try:
+            results = await asyncio.wait_for(
+                _cached_query_medgemma_batch(img, prompts, tokens, stops, img_key=img_key),
+                timeout=30.0,
             )
-
-        # Execute concurrently
-        results = await asyncio.gather(*tasks)
+        except asyncio.TimeoutError:
+            logger.warning("MedGemma enhance timed out after 30s")
+            return {
+                "synthesis": "Unable to generate clinical synthesis.",
+                "imaging_context": None,
+            }
         
         # --- Process Synthesis ---
         resp_synthesis = results[0]
         reply_synthesis = ""
         if isinstance(resp_synthesis, list) and len(resp_synthesis) > 0:
-            reply_synthesis = resp_synthesis[0].get("generated_text", "").strip()
-            
-            if "Clinical Synthesis:" in reply_synthesis:
-                reply_synthesis = reply_synthesis.split("Clinical Synthesis:")[-1].strip()
-            if "Final Answer" in reply_synthesis:
-                reply_synthesis = reply_synthesis.split("Final Answer")[0].strip()
-                
-            import re
-            reply_synthesis = re.sub(r"\\boxed{", "", reply_synthesis)
-            if reply_synthesis.endswith("}"): reply_synthesis = reply_synthesis[:-1].strip()
-            reply_synthesis = re.sub(r"^[\W_]+", "", reply_synthesis)
-
-            # Deduplication
-            lines = [line.strip() for line in reply_synthesis.split('\n') if line.strip()]
-            seen = set()
-            dedupped_lines = []
-            for line in lines:
-                norm_line = re.sub(r'\W+', '', line.lower())
-                if norm_line not in seen:
-                    seen.add(norm_line)
-                    dedupped_lines.append(line)
-            reply_synthesis = '\n\n'.join(dedupped_lines)
+            reply_synthesis = _clean_reply(
+                resp_synthesis[0].get("generated_text", ""), "Clinical Synthesis:"
+            )
 
         if not reply_synthesis:
             reply_synthesis = "Unable to generate clinical synthesis."
@@ -841,28 +1288,9 @@ async def enhance_profile(
         if has_image and len(results) > 1:
             resp_imaging = results[1]
             if isinstance(resp_imaging, list) and len(resp_imaging) > 0:
-                reply_imaging = resp_imaging[0].get("generated_text", "").strip()
-                
-                if "Imaging Context:" in reply_imaging:
-                    reply_imaging = reply_imaging.split("Imaging Context:")[-1].strip()
-                if "Final Answer" in reply_imaging:
-                    reply_imaging = reply_imaging.split("Final Answer")[0].strip()
-                    
-                import re
-                reply_imaging = re.sub(r"\\boxed{", "", reply_imaging)
-                if reply_imaging.endswith("}"): reply_imaging = reply_imaging[:-1].strip()
-                reply_imaging = re.sub(r"^[\W_]+", "", reply_imaging)
-
-                # Deduplication
-                lines = [line.strip() for line in reply_imaging.split('\n') if line.strip()]
-                seen = set()
-                dedupped_lines = []
-                for line in lines:
-                    norm_line = re.sub(r'\W+', '', line.lower())
-                    if norm_line not in seen:
-                        seen.add(norm_line)
-                        dedupped_lines.append(line)
-                reply_imaging = '\n\n'.join(dedupped_lines)
+                reply_imaging = _clean_reply(
+                    resp_imaging[0].get("generated_text", ""), "Imaging Context:"
+                )
 
         return {
             "synthesis": reply_synthesis,
@@ -870,7 +1298,7 @@ async def enhance_profile(
         }
             
     except Exception as e:
-        print(f"MedGemma enhance error: {e}")
+        logger.warning("MedGemma enhance error: %s", e)
         return {"synthesis": "I'm sorry, I couldn't generate the clinical synthesis right now.", "imaging_context": None}
 
     return {"synthesis": "Unable to process the request.", "imaging_context": None}
@@ -898,10 +1326,8 @@ async def explain_selection(
         f"Do NOT repeat the phrase back as a complete sentence. Start directly with the explanation."
     )
 
-    dummy_img = Image.new("RGB", (336, 336), color=(0, 0, 0))
     try:
-        import asyncio
-        resp = await asyncio.to_thread(query_medgemma, dummy_img, prompt=prompt, max_tokens=120)
+        resp = await _cached_query_medgemma(_DUMMY_IMG, prompt, 120)
         explanation = ""
         if isinstance(resp, list) and len(resp) > 0:
             raw = resp[0].get("generated_text", "").strip()
@@ -910,8 +1336,7 @@ async def explain_selection(
                 if marker and raw.endswith(marker) is False and marker in raw:
                     raw = raw.split(marker)[-1].strip()
             # Keep only first 2 sentences
-            import re as _re
-            sentences = _re.split(r"(?<=[.!?])\s+", raw)
+            sentences = _SENT_SPLIT_RE.split(raw)
             explanation = " ".join(sentences[:2]).strip()
 
         if not explanation:
@@ -919,7 +1344,7 @@ async def explain_selection(
 
         return {"explanation": explanation}
     except Exception as e:
-        print(f"MedGemma explain_selection error: {e}")
+        logger.warning("MedGemma explain_selection error: %s", e)
         return {"explanation": f'"{selected_text}" — unable to reach the AI explanation engine right now.'}
 
 
@@ -957,6 +1382,227 @@ async def extract(
     return {"profile": profile}
 
 
+# ──────────────────────────────────────────────────────────────────────────────
+# _extract_profile patterns — compiled once at import. The regex scan is the
+# hot CPU work of /extract; inline re.search literals paid a compile-cache
+# probe and flag parsing on every single call.
+# ──────────────────────────────────────────────────────────────────────────────
+_AGE_RE = re.compile(r"(\d{1,3})\s*[- ]?(?:year|yr)s?[- ]?old", re.I)
+_FEMALE_RE = re.compile(r"\bfemale\b|\bwoman\b", re.I)
+_MALE_RE = re.compile(r"\bmale\b|\bman\b", re.I)
+
+# Keyword families are split by matcher kind: a tuple of lowercase literals
+# is tested with `in` against the pre-lowered text — a C-level substring
+# search, far cheaper than the regex engine for plain words — while the few
+# patterns that need word boundaries keep a compiled regex.
+_COMORB_KEYWORDS = (
+    ("hypertension", ("hypertension", "htn")),
+    ("type 2 diabetes", ("type 2 diabet", "t2dm", "dm2")),
+    ("type 1 diabetes", ("type 1 diabet", "t1dm", "dm1")),
+    ("atrial fibrillation", re.compile(r"atrial fibrillation|AF\b|AFib", re.I)),
+    ("heart failure", ("heart failure", "chf")),
+    ("COPD", ("copd", "chronic obstructive")),
+    ("asthma", ("asthma",)),
+    ("liver cirrhosis", ("cirrhosis",)),
+    ("hepatocellular carcinoma", ("hepatocellular carcinoma", "hcc")),
+    ("chronic kidney disease", ("chronic kidney", "ckd")),
+    ("coronary artery disease", ("coronary artery disease", "cad")),
+    ("obesity", ("obesity",)),
+)
+
+_CC_RE = re.compile(
+    r"(?:present(?:ing)? with|complaint of|admitted for|scheduled for)\s+([^.!?\n]{5,120})", re.I
+)
+_DUR_RE = re.compile(r"(?:for|over|duration of)\s+((?:\d+\s*)?(?:day|week|month|year)s?)", re.I)
+
+_CT_RE = re.compile(r"ct|computed tomography", re.I)
+_MRI_RE = re.compile(r"mri", re.I)
+_XRAY_RE = re.compile(r"x[- ]?ray|cxr|chest x", re.I)
+_THORAX_RE = re.compile(r"thorax|chest|pulmonary|lung", re.I)
+_ABDOMEN_RE = re.compile(r"abdomen|abdominal|liver", re.I)
+_HEAD_RE = re.compile(r"brain|head|neuro", re.I)
+_PA_VIEW_RE = re.compile(r"\bPA\b|posteroanterior", re.I)
+_AP_VIEW_RE = re.compile(r"\bAP\b|anteroposterior", re.I)
+
+_DIAG_KEYWORDS = (
+    ("scimitar syndrome", ("scimitar",)),
+    ("community-acquired pneumonia", ("pneumonia",)),
+    ("pulmonary embolism", re.compile(r"pulmonary embolism|PE\b", re.I)),
+    ("lung malignancy", ("lung malignancy", "lung cancer", "nsclc", "sclc")),
+    ("acute ischemic stroke", ("stroke", "ischemic")),
+    ("heart failure", ("heart failure", "pulmonary edema")),
+    ("pneumothorax", ("pneumothorax",)),
+    ("pleural effusion", ("pleural effusion",)),
+    ("aortic dissection", ("aortic dissection",)),
+)
+
+# Simple yes/no flags (all literal); precedence between competing flags is
+# resolved where the hits are applied, preserving the original elif order.
+_FLAG_KEYWORDS = (
+    ("immuno", ("immunocompromised", "immunosuppressed")),
+    ("no_allergy", ("no known allerg",)),
+    ("urgent", ("urgent", "emergency", "stat")),
+    ("routine", ("routine", "elective", "scheduled")),
+    ("infection", ("infection", "sepsis", "pneumonia", "fever")),
+    ("icu", ("icu", "intensive care", "critical")),
+)
+
+_FINDING_KEYWORDS = (
+    ("consolidation", ("consolidat",)),
+    ("atelectasis", ("atelectasis", "collapse")),
+    ("edema", ("edema",)),
+    ("effusion", ("effusion", "pleural fluid")),
+    ("pneumothorax", ("pneumothorax",)),
+    ("cardiomegaly", ("cardiomegal", "enlarged heart")),
+)
+
+_SMOKE_RE = re.compile(
+    r"(?:smok(?:ing|er|es)|tobacco)[^\.\n]{0,60}?((?:\d+\s*)?(?:pack[- ]?year|cigarette|cigar|pipe)[^\.\n]{0,40})?",
+    re.I,
+)
+_NONSMOKE_RE = re.compile(r"non[- ]?smok|never smoked|no smoking", re.I)
+_ALCOHOL_RE = re.compile(r"alcohol[^\.\n]{0,80}", re.I)
+_BMI_RE = re.compile(r"BMI\s*(?:of\s*)?(\d{1,2}(?:\.\d)?)", re.I)
+_HEIGHT_RE = re.compile(r"(\d{1,3})\s*(?:cm|ft|feet|inches?)", re.I)
+_BLOOD_TYPE_RE = re.compile(
+    r"\b(A|B|AB|O)[+-]?\s*blood\s*type|\bblood\s*type\s*(A|B|AB|O)[+-]?\b", re.I
+)
+_FAM_HX_RE = re.compile(r"family\s*(?:history|hx)[^\.\n]{0,150}", re.I)
+_OCCUPATION_RE = re.compile(r"(?:occupation|works?\s*as|employed\s*(?:as|at)|profession)[^\.\n]{0,80}", re.I)
+_ETHNICITY_RE = re.compile(r"(?:ethnicity|race|racial background)\s*[:\-]?\s*([A-Za-z\s\-]+)", re.I)
+_VAX_RE = re.compile(r"(?:vaccin|immuniz)[^\.\n]{0,80}", re.I)
+_TRAVEL_RE = re.compile(r"(?:travel(?:led|ed)?\s*(?:to|from)|recent\s*travel)[^\.\n]{0,100}", re.I)
+_FUNC_STATUS_RE = re.compile(
+    r"(?:functional status|ADLs?|activities of daily|ambulates?|independent)[^\.\n]{0,80}", re.I
+)
+_CODE_STATUS_RE = re.compile(r"(?:code\s*status|full\s*code|DNR|DNI|comfort\s*care)[^\.\n]{0,60}", re.I)
+_SOCIAL_HX_RE = re.compile(r"social\s*(?:history|hx)[^\.\n]{0,200}", re.I)
+
+def _keyword_hit(matcher, lowered: str, text: str) -> bool:
+    """True if a family entry matches: literal tuples are checked against the
+    pre-lowered text with `in`, compiled patterns against the original."""
+    if isinstance(matcher, tuple):
+        return any(lit in lowered for lit in matcher)
+    return matcher.search(text) is not None
+
+
+def _keyword_hits(family, lowered: str, text: str) -> set:
+    """Names of every family entry that matches the text."""
+    return {name for name, m in family if _keyword_hit(m, lowered, text)}
+
+
+def _fast_uuid_pair() -> tuple[str, str]:
+    """Two uuid4-shaped IDs from a single 256-bit PRNG draw. Profile/case/
+    image IDs are internal keys, not secrets, so this skips the per-call
+    urandom read (a syscall) that uuid.uuid4 does — and one draw covers
+    both IDs a request needs."""
+    h = "%064x" % random.getrandbits(256)
+    return (
+        f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:32]}",
+        f"{h[32:40]}-{h[40:44]}-{h[44:48]}-{h[48:52]}-{h[52:]}",
+    )
+
+
+
+# The extracted-profile skeleton is ~80 fields across a dozen nested dicts;
+# building that literal per request is pure allocation work. It is serialized
+# once at import and each call rehydrates a fresh copy with orjson.loads,
+# which beats both the literal and copy.deepcopy for JSON-shaped data.
+_PROFILE_TEMPLATE: dict = {
+    "profile_id": None,
+    "case_id": None,
+    "image_id": None,
+    "patient": {
+        "age_years": None,
+        "sex": None,
+        "immunocompromised": None,
+        "weight_kg": None,
+        "comorbidities": [],
+        "medications": [],
+        "allergies": None,
+    },
+    "presentation": {
+        "chief_complaint": None,
+        "symptom_duration": None,
+        "hpi": None,
+        "pmh": None,
+    },
+    "study": {
+        "modality": None,
+        "body_region": None,
+        "view_position": None,
+        "radiology_region": None,
+        "caption": None,
+        "image_type": None,
+        "image_subtype": None,
+        "image_url": None,
+        "storage_path": None,
+    },
+    "assessment": {
+        "diagnosis_primary": None,
+        "suspected_primary": [],
+        "differential": [],
+        "urgency": None,
+        "infectious_concern": None,
+        "icu_candidate": None,
+    },
+    "findings": {
+        "lungs": {
+            "consolidation_present": "no",
+            "consolidation_locations": [],
+            "consolidation_extent": "unknown",
+            "atelectasis_present": "no",
+            "atelectasis_locations": [],
+            "edema_present": "no",
+            "edema_pattern": "unknown",
+        },
+        "pleura": {
+            "effusion_present": "no",
+            "effusion_side": "unknown",
+            "effusion_size": "unknown",
+            "pneumothorax_present": "no",
+            "pneumothorax_side": "unknown",
+        },
+        "cardiomediastinal": {
+            "cardiomegaly": "no",
+            "mediastinal_widening": "no",
+        },
+        "devices": {
+            "lines_tubes_present": "no",
+            "device_list": [],
+        },
+    },
+    "summary": {
+        "one_liner": None,
+        "key_points": [],
+        "red_flags": [],
+    },
+    "outcome": {
+        "success": None,
+        "detail": None,
+    },
+    "provenance": {
+        "dataset_name": None,
+        "pmc_id": None,
+        "pmid": None,
+        "doi": None,
+        "article_title": None,
+        "journal": None,
+        "year": None,
+        "authors": [],
+        "license": None,
+        "source_url": None,
+    },
+    "tags": {
+        "ml_labels": [],
+        "gt_labels": [],
+        "keywords": [],
+        "mesh_terms": [],
+    },
+}
+_PROFILE_TEMPLATE_JSON = orjson.dumps(_PROFILE_TEMPLATE)
+
+
 async def _extract_profile(images: Optional[List[UploadFile]], text: str) -> dict:
     """
     Extracts a structured CaseProfile. 
@@ -969,160 +1615,96 @@ async def _extract_profile(images: Optional[List[UploadFile]], text: str) -> dic
     medgemma_insight = ""
     if images and len(images) > 0:
         try:
-            # Read the first image for analysis
-            contents = await images[0].read()
-            # Reset seek position if it's going to be used elsewhere, though here we are done with it
-            images[0].file.seek(0) 
-            img_pil = Image.open(io.BytesIO(contents)).convert("RGB")
-            
+            # Decode the first image straight from its spooled temp file —
+            # no intermediate bytes copy of the whole upload.
+            images[0].file.seek(0)
+            img_pil = _decode_image(images[0].file)
+
+
             prompt = f"Analyze this chest X-ray image in the context of these clinical notes: '{text}'. Identify key findings like consolidation, effusion, or cardiomegaly. Be structured."
-            response = query_medgemma(img_pil, prompt=prompt, max_tokens=300)
-            
+            response = await asyncio.to_thread(
+                query_medgemma, img_pil, prompt=prompt, max_tokens=300
+            )
+
             if isinstance(response, list) and len(response) > 0:
                 medgemma_insight = response[0].get("generated_text", "")
         except Exception as e:
-            print(f"MedGemma extraction error: {e}")
-
-    case_id = str(uuid.uuid4())
-    image_id = str(uuid.uuid4())
-
-    profile: dict = {
-        "profile_id": f"{case_id}:{image_id}",
-        "case_id": case_id,
-        "image_id": image_id,
-        "patient": {
-            "age_years": None,
-            "sex": None,
-            "immunocompromised": None,
-            "weight_kg": None,
-            "comorbidities": [],
-            "medications": [],
-            "allergies": None,
-        },
-        "presentation": {
-            "chief_complaint": None,
-            "symptom_duration": None,
-            "hpi": None,
-            "pmh": None,
-        },
-        "study": {
-            "modality": None,
-            "body_region": None,
-            "view_position": None,
-            "radiology_region": None,
-            "caption": None,
-            "image_type": None,
-            "image_subtype": None,
-            "image_url": None,
-            "storage_path": None,
-        },
-        "assessment": {
-            "diagnosis_primary": None,
-            "suspected_primary": [],
-            "differential": [],
-            "urgency": None,
-            "infectious_concern": None,
-            "icu_candidate": None,
-        },
-        "findings": {
-            "lungs": {
-                "consolidation_present": "no",
-                "consolidation_locations": [],
-                "consolidation_extent": "unknown",
-                "atelectasis_present": "no",
-                "atelectasis_locations": [],
-                "edema_present": "no",
-                "edema_pattern": "unknown",
-            },
-            "pleura": {
-                "effusion_present": "no",
-                "effusion_side": "unknown",
-                "effusion_size": "unknown",
-                "pneumothorax_present": "no",
-                "pneumothorax_side": "unknown",
-            },
-            "cardiomediastinal": {
-                "cardiomegaly": "no",
-                "mediastinal_widening": "no",
-            },
-            "devices": {
-                "lines_tubes_present": "no",
-                "device_list": [],
-            },
-        },
-        "summary": {
-            "one_liner": None,
-            "key_points": [],
-            "red_flags": [],
-        },
-        "outcome": {
-            "success": None,
-            "detail": None,
-        },
-        "provenance": {
-            "dataset_name": None,
-            "pmc_id": None,
-            "pmid": None,
-            "doi": None,
-            "article_title": None,
-            "journal": None,
-            "year": None,
-            "authors": [],
-            "license": None,
-            "source_url": None,
-        },
-        "tags": {
-            "ml_labels": [],
-            "gt_labels": [],
-            "keywords": [],
-            "mesh_terms": [],
-        },
-    }
+            logger.warning("MedGemma extraction error: %s", e)
+
+    # The regex core is pure CPU work; run it off the event loop so the ~40
+    # pattern scans don't stall every other in-flight request.
+    return await asyncio.to_thread(
+        _extract_profile_sync, text, image_names, medgemma_insight
+    )
+
+
+def _detect_modality(profile: dict, text: str, image_names: list[str]) -> None:
+    """Fill study modality from the notes, falling back to the (short)
+    filename string so hints like 'cxr_01.png' still count. The two are
+    scanned separately rather than concatenated — that copy re-scanned
+    multi-KB notes once per modality branch."""
+    names_str = " ".join(image_names)
+    if _CT_RE.search(text) or _CT_RE.search(names_str):
+        profile["study"].update({"modality": "CT", "image_type": "radiology", "image_subtype": "ct"})
+    elif _MRI_RE.search(text) or _MRI_RE.search(names_str):
+        profile["study"].update({"modality": "MRI", "image_type": "radiology", "image_subtype": "mri"})
+    elif _XRAY_RE.search(text) or _XRAY_RE.search(names_str):
+        profile["study"].update({"modality": "CXR", "image_type": "radiology", "image_subtype": "x_ray"})
+    elif image_names:
+        profile["study"].update({"modality": "Imaging", "image_type": "radiology"})
+
+
+def _extract_profile_sync(text: str, image_names: list[str], medgemma_insight: str) -> dict:
+    """Synchronous core of /extract: every regex scan plus profile assembly."""
+    case_id, image_id = _fast_uuid_pair()
+
+    profile: dict = orjson.loads(_PROFILE_TEMPLATE_JSON)
+    profile["profile_id"] = f"{case_id}:{image_id}"
+    profile["case_id"] = case_id
+    profile["image_id"] = image_id
+
+    # Image-only upload with no model insight: there is nothing for the
+    # keyword scans to find, so skip all ~40 of them and keep the template
+    # defaults (matching what the full pass produces on empty text).
+    if not text and not medgemma_insight:
+        _detect_modality(profile, text, image_names)
+        profile["assessment"]["infectious_concern"] = "no"
+        profile["assessment"]["icu_candidate"] = "no"
+        profile["extra_fields"] = {}
+        return profile
 
     # ── Patient ──────────────────────────────────────────────────────────────
-    age_m = re.search(r"(\d{1,3})\s*[- ]?(?:year|yr)s?[- ]?old", text, re.I)
+    lowered = text.lower()
+
+    age_m = _AGE_RE.search(text)
     if age_m:
         profile["patient"]["age_years"] = int(age_m.group(1))
 
-    if re.search(r"\bfemale\b|\bwoman\b", text, re.I):
+    flag_hits = _keyword_hits(_FLAG_KEYWORDS, lowered, text)
+    if _FEMALE_RE.search(text):
         profile["patient"]["sex"] = "female"
-    elif re.search(r"\bmale\b|\bman\b", text, re.I):
+    elif _MALE_RE.search(text):
         profile["patient"]["sex"] = "male"
 
-    if re.search(r"immunocompromised|immunosuppressed", text, re.I):
+    if "immuno" in flag_hits:
         profile["patient"]["immunocompromised"] = "yes"
     elif text.strip():
         profile["patient"]["immunocompromised"] = "no"
 
-    comorbidity_map = [
-        (r"hypertension|HTN", "hypertension"),
-        (r"type 2 diabet|T2DM|DM2", "type 2 diabetes"),
-        (r"type 1 diabet|T1DM|DM1", "type 1 diabetes"),
-        (r"atrial fibrillation|AF\b|AFib", "atrial fibrillation"),
-        (r"heart failure|CHF", "heart failure"),
-        (r"COPD|chronic obstructive", "COPD"),
-        (r"asthma", "asthma"),
-        (r"cirrhosis|liver cirrhosis", "liver cirrhosis"),
-        (r"hepatocellular carcinoma|HCC", "hepatocellular carcinoma"),
-        (r"chronic kidney|CKD", "chronic kidney disease"),
-        (r"coronary artery disease|CAD", "coronary artery disease"),
-        (r"obesity", "obesity"),
+    comorbidities = [
+        label for label, m in _COMORB_KEYWORDS if _keyword_hit(m, lowered, text)
     ]
-    comorbidities = [label for pattern, label in comorbidity_map if re.search(pattern, text, re.I)]
     profile["patient"]["comorbidities"] = comorbidities
 
-    if re.search(r"no known allerg", text, re.I):
+    if "no_allergy" in flag_hits:
         profile["patient"]["allergies"] = "no known allergies"
 
     # ── Presentation ─────────────────────────────────────────────────────────
-    cc_m = re.search(
-        r"(?:present(?:ing)? with|complaint of|admitted for|scheduled for)\s+([^.!?\n]{5,120})",
-        text, re.I
-    )
+    cc_m = _CC_RE.search(text)
     if cc_m:
         profile["presentation"]["chief_complaint"] = cc_m.group(1).strip()
 
-    dur_m = re.search(r"(?:for|over|duration of)\s+((?:\d+\s*)?(?:day|week|month|year)s?)", text, re.I)
+    dur_m = _DUR_RE.search(text)
     if dur_m:
         profile["presentation"]["symptom_duration"] = dur_m.group(1).strip()
 
@@ -1133,78 +1715,63 @@ async def _extract_profile(images: Optional[List[UploadFile]], text: str) -> dic
         profile["presentation"]["pmh"] = ", ".join(comorbidities)
 
     # ── Study ────────────────────────────────────────────────────────────────
-    combined = text + " " + " ".join(image_names)
-    if re.search(r"ct|computed tomography", combined, re.I):
-        profile["study"].update({"modality": "CT", "image_type": "radiology", "image_subtype": "ct"})
-    elif re.search(r"mri", combined, re.I):
-        profile["study"].update({"modality": "MRI", "image_type": "radiology", "image_subtype": "mri"})
-    elif re.search(r"x[- ]?ray|cxr|chest x", combined, re.I):
-        profile["study"].update({"modality": "CXR", "image_type": "radiology", "image_subtype": "x_ray"})
-    elif image_names:
-        profile["study"].update({"modality": "Imaging", "image_type": "radiology"})
+    _detect_modality(profile, text, image_names)
 
-    if re.search(r"thorax|chest|pulmonary|lung", text, re.I):
+    if _THORAX_RE.search(text):
         profile["study"]["body_region"] = "thorax"
         profile["study"]["radiology_region"] = "thorax"
-    elif re.search(r"abdomen|abdominal|liver", text, re.I):
+    elif _ABDOMEN_RE.search(text):
         profile["study"]["body_region"] = "abdomen"
-    elif re.search(r"brain|head|neuro", text, re.I):
+    elif _HEAD_RE.search(text):
         profile["study"]["body_region"] = "head"
 
-    if re.search(r"\bPA\b|posteroanterior", text, re.I):
+    if _PA_VIEW_RE.search(text):
         profile["study"]["view_position"] = "PA"
-    elif re.search(r"\bAP\b|anteroposterior", text, re.I):
+    elif _AP_VIEW_RE.search(text):
         profile["study"]["view_position"] = "AP"
 
     # ── Assessment ───────────────────────────────────────────────────────────
-    diag_map = [
-        (r"scimitar", "scimitar syndrome"),
-        (r"pneumonia", "community-acquired pneumonia"),
-        (r"pulmonary embolism|PE\b", "pulmonary embolism"),
-        (r"lung malignancy|lung cancer|NSCLC|SCLC", "lung malignancy"),
-        (r"stroke|ischemic", "acute ischemic stroke"),
-        (r"heart failure|pulmonary edema", "heart failure"),
-        (r"pneumothorax", "pneumothorax"),
-        (r"pleural effusion", "pleural effusion"),
-        (r"aortic dissection", "aortic dissection"),
-    ]
-    for pattern, diag in diag_map:
-        if re.search(pattern, text, re.I):
+    for diag, m in _DIAG_KEYWORDS:
+        if _keyword_hit(m, lowered, text):
             profile["assessment"]["diagnosis_primary"] = diag
             profile["assessment"]["suspected_primary"] = [diag] + comorbidities[:2]
             break
 
-    if re.search(r"urgent|emergency|stat", text, re.I):
+    if "urgent" in flag_hits:
         profile["assessment"]["urgency"] = "emergent"
-    elif re.search(r"routine|elective|scheduled", text, re.I):
+    elif "routine" in flag_hits:
         profile["assessment"]["urgency"] = "routine"
     elif text.strip():
         profile["assessment"]["urgency"] = "semi-urgent"
 
     profile["assessment"]["infectious_concern"] = (
-        "yes" if re.search(r"infection|sepsis|pneumonia|fever", text, re.I) else "no"
+        "yes" if "infection" in flag_hits else "no"
     )
     profile["assessment"]["icu_candidate"] = (
-        "yes" if re.search(r"icu|intensive care|critical", text, re.I) else "no"
+        "yes" if "icu" in flag_hits else "no"
     )
 
     # ── Findings tweaks ──────────────────────────────────────────────────────
     # ── MedGemma Insight Integration ──────────────────────────────────────────
-    # We combine the original text with MedGemma's findings for the regex extractor
-    # to pick up confirmed findings from the image.
-    analysis_text = text + "\n" + medgemma_insight
-
-    if re.search(r"consolidation|consolidat", analysis_text, re.I):
+    # Findings confirmed by MedGemma's image analysis count alongside the
+    # notes. Check the two strings separately and union the hits — no
+    # text-sized concat copy, and the insight check is skipped entirely when
+    # the notes already flagged every finding.
+    finding_hits = _keyword_hits(_FINDING_KEYWORDS, lowered, text)
+    if medgemma_insight and len(finding_hits) < len(_FINDING_KEYWORDS):
+        insight_lowered = medgemma_insight.lower()
+        finding_hits |= _keyword_hits(_FINDING_KEYWORDS, insight_lowered, medgemma_insight)
+    if "consolidation" in finding_hits:
         profile["findings"]["lungs"]["consolidation_present"] = "yes"
-    if re.search(r"atelectasis|collapse", analysis_text, re.I):
+    if "atelectasis" in finding_hits:
         profile["findings"]["lungs"]["atelectasis_present"] = "yes"
-    if re.search(r"edema|pulmonary edema", analysis_text, re.I):
+    if "edema" in finding_hits:
         profile["findings"]["lungs"]["edema_present"] = "yes"
-    if re.search(r"effusion|pleural fluid", analysis_text, re.I):
+    if "effusion" in finding_hits:
         profile["findings"]["pleura"]["effusion_present"] = "yes"
-    if re.search(r"pneumothorax", analysis_text, re.I):
+    if "pneumothorax" in finding_hits:
         profile["findings"]["pleura"]["pneumothorax_present"] = "yes"
-    if re.search(r"cardiomegaly|enlarged heart|cardiomegal", analysis_text, re.I):
+    if "cardiomegaly" in finding_hits:
         profile["findings"]["cardiomediastinal"]["cardiomegaly"] = "yes"
 
     if medgemma_insight and not profile["summary"]["one_liner"]:
@@ -1226,88 +1793,82 @@ async def _extract_profile(images: Optional[List[UploadFile]], text: str) -> dic
     # ── Extra Fields (schema expansion) ──────────────────────────────────────
     # Scan for clinical data that doesn't fit the base schema.
     # These are captured at ANY point during intake (any confidence level).
+    # Notes shorter than a sentence can't contain any of these snippets, so
+    # the ~14 scans only run for real narratives.
     extra_fields: dict = {}
+    if len(text) > 40:
 
-    # Smoking / tobacco
-    smoke_m = re.search(
-        r"(?:smok(?:ing|er|es)|tobacco)[^\.\n]{0,60}?((?:\d+\s*)?(?:pack[- ]?year|cigarette|cigar|pipe)[^\.\n]{0,40})?",
-        text, re.I
-    )
-    if smoke_m:
-        detail = smoke_m.group(1)
-        extra_fields["smoking_status"] = detail.strip() if detail and detail.strip() else "smoker"
-
-    # Never smoked
-    if re.search(r"non[- ]?smok|never smoked|no smoking", text, re.I):
-        extra_fields["smoking_status"] = "non-smoker"
-
-    # Alcohol use
-    alcohol_m = re.search(r"alcohol[^\.\n]{0,80}", text, re.I)
-    if alcohol_m:
-        snippet = alcohol_m.group(0).strip()
-        extra_fields["alcohol_use"] = snippet[:120]
-
-    # BMI / weight / height
-    bmi_m = re.search(r"BMI\s*(?:of\s*)?(\d{1,2}(?:\.\d)?)", text, re.I)
-    if bmi_m:
-        extra_fields["bmi"] = bmi_m.group(1)
-
-    height_m = re.search(r"(\d{1,3})\s*(?:cm|ft|feet|inches?)", text, re.I)
-    if height_m and "bmi" not in extra_fields:
-        extra_fields["height"] = f"{height_m.group(1)} {height_m.group(0).split(height_m.group(1))[-1].strip()}"
-
-    # Blood type
-    blood_m = re.search(r"\b(A|B|AB|O)[+-]?\s*blood\s*type|\bblood\s*type\s*(A|B|AB|O)[+-]?\b", text, re.I)
-    if blood_m:
-        extra_fields["blood_type"] = (blood_m.group(1) or blood_m.group(2)).upper()
-
-    # Family history
-    fam_m = re.search(r"family\s*(?:history|hx)[^\.\n]{0,150}", text, re.I)
-    if fam_m:
-        extra_fields["family_history"] = fam_m.group(0).strip()[:200]
-
-    # Occupation / employment
-    occ_m = re.search(r"(?:occupation|works?\s*as|employed\s*(?:as|at)|profession)[^\.\n]{0,80}", text, re.I)
-    if occ_m:
-        extra_fields["occupation"] = occ_m.group(0).strip()[:120]
-
-    # Ethnicity / race
-    eth_m = re.search(
-        r"(?:ethnicity|race|racial background)\s*[:\-]?\s*([A-Za-z\s\-]+)",
-        text, re.I
-    )
-    if eth_m:
-        extra_fields["ethnicity"] = eth_m.group(1).strip()[:60]
-
-    # Vaccination status
-    vax_m = re.search(r"(?:vaccin|immuniz)[^\.\n]{0,80}", text, re.I)
-    if vax_m:
-        extra_fields["vaccination"] = vax_m.group(0).strip()[:120]
-
-    # Travel history
-    travel_m = re.search(r"(?:travel(?:led|ed)?\s*(?:to|from)|recent\s*travel)[^\.\n]{0,100}", text, re.I)
-    if travel_m:
-        extra_fields["travel_history"] = travel_m.group(0).strip()[:150]
-
-    # Functional status / ADLs
-    func_m = re.search(r"(?:functional status|ADLs?|activities of daily|ambulates?|independent)[^\.\n]{0,80}", text, re.I)
-    if func_m:
-        extra_fields["functional_status"] = func_m.group(0).strip()[:120]
-
-    # Code status / DNR
-    code_m = re.search(r"(?:code\s*status|full\s*code|DNR|DNI|comfort\s*care)[^\.\n]{0,60}", text, re.I)
-    if code_m:
-        extra_fields["code_status"] = code_m.group(0).strip()[:80]
-
-    # Social history (catch-all if not already captured)
-    social_m = re.search(r"social\s*(?:history|hx)[^\.\n]{0,200}", text, re.I)
-    if social_m:
-        extra_fields["social_history"] = social_m.group(0).strip()[:250]
-
-    if extra_fields:
-        profile["extra_fields"] = extra_fields
-    else:
-        profile["extra_fields"] = {}
+        # Smoking / tobacco
+        smoke_m = _SMOKE_RE.search(text)
+        if smoke_m:
+            detail = smoke_m.group(1)
+            extra_fields["smoking_status"] = detail.strip() if detail and detail.strip() else "smoker"
+
+        # Never smoked
+        if _NONSMOKE_RE.search(text):
+            extra_fields["smoking_status"] = "non-smoker"
+
+        # Alcohol use
+        alcohol_m = _ALCOHOL_RE.search(text)
+        if alcohol_m:
+            snippet = alcohol_m.group(0).strip()
+            extra_fields["alcohol_use"] = snippet[:120]
+
+        # BMI / weight / height
+        bmi_m = _BMI_RE.search(text)
+        if bmi_m:
+            extra_fields["bmi"] = bmi_m.group(1)
+
+        height_m = _HEIGHT_RE.search(text)
+        if height_m and "bmi" not in extra_fields:
+            extra_fields["height"] = f"{height_m.group(1)} {height_m.group(0).split(height_m.group(1))[-1].strip()}"
+
+        # Blood type
+        blood_m = _BLOOD_TYPE_RE.search(text)
+        if blood_m:
+            extra_fields["blood_type"] = (blood_m.group(1) or blood_m.group(2)).upper()
+
+        # Family history
+        fam_m = _FAM_HX_RE.search(text)
+        if fam_m:
+            extra_fields["family_history"] = fam_m.group(0).strip()[:200]
+
+        # Occupation / employment
+        occ_m = _OCCUPATION_RE.search(text)
+        if occ_m:
+            extra_fields["occupation"] = occ_m.group(0).strip()[:120]
+
+        # Ethnicity / race
+        eth_m = _ETHNICITY_RE.search(text)
+        if eth_m:
+            extra_fields["ethnicity"] = eth_m.group(1).strip()[:60]
+
+        # Vaccination status
+        vax_m = _VAX_RE.search(text)
+        if vax_m:
+            extra_fields["vaccination"] = vax_m.group(0).strip()[:120]
+
+        # Travel history
+        travel_m = _TRAVEL_RE.search(text)
+        if travel_m:
+            extra_fields["travel_history"] = travel_m.group(0).strip()[:150]
+
+        # Functional status / ADLs
+        func_m = _FUNC_STATUS_RE.search(text)
+        if func_m:
+            extra_fields["functional_status"] = func_m.group(0).strip()[:120]
+
+        # Code status / DNR
+        code_m = _CODE_STATUS_RE.search(text)
+        if code_m:
+            extra_fields["code_status"] = code_m.group(0).strip()[:80]
+
+        # Social history (catch-all if not already captured)
+        social_m = _SOCIAL_HX_RE.search(text)
+        if social_m:
+            extra_fields["social_history"] = social_m.group(0).strip()[:250]
+
+    profile["extra_fields"] = extra_fields
 
     return profile
 
@@ -1325,18 +1886,13 @@ async def analyze_hospital_page(
     Triggers the CrewAI agent to scrape the given hospital URL and return doctors
     specializing in the given diagnosis.
     """
-    import asyncio
-    import agents
-    
-    print(f"[{datetime.now().strftime('%H:%M:%S')}] [analyze_hospital_page] Received request for {hospital_name} (location: {location})")
-    print(f"[{datetime.now().strftime('%H:%M:%S')}] [analyze_hospital_page] LANGCHAIN_TRACING_V2={os.getenv('LANGCHAIN_TRACING_V2')}")
+    logger.info("[analyze_hospital_page] Received request for %s (location: %s)", hospital_name, location)
+    logger.info("[analyze_hospital_page] LANGCHAIN_TRACING_V2=%s", os.getenv('LANGCHAIN_TRACING_V2'))
     
     try:
         # Run CrewAI synchronously inside an async thread to prevent blocking Uvicorn
         data = await asyncio.to_thread(agents.analyze_hospital_staff, url, diagnosis, hospital_name, location)
         return {"specialists": data}
     except Exception as e:
-        import traceback
-        traceback.print_exc()
-        print(f"Agent endpoint failed: {e}")
+        logger.exception("Agent endpoint failed: %s", e)
         return {"specialists": [], "error": str(e)}
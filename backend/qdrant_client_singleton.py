@@ -0,0 +1,31 @@
+"""
+Process-global QdrantClient.
+
+Every module used to build its own QdrantClient, so each paid a fresh HTTPS
+handshake to Qdrant Cloud. get_client() hands out one lazily-initialized
+client with prefer_grpc=True, so scroll/search calls multiplex over a single
+persistent connection.
+"""
+
+import functools
+import os
+
+from qdrant_client import QdrantClient
+from dotenv import load_dotenv
+
+load_dotenv()
+
+QDRANT_URL = os.getenv("QDRANT_URL")
+QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
+
+
+@functools.lru_cache(maxsize=1)
+def get_client() -> QdrantClient:
+    client = QdrantClient(
+        url=QDRANT_URL,
+        api_key=QDRANT_API_KEY,
+        prefer_grpc=True,
+        timeout=30,
+    )
+    print(f"[QdrantService] Connected to {QDRANT_URL}")
+    return client
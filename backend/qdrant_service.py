@@ -5,25 +5,14 @@ Payload fields match dataset_schema.json (new nested schema).
 """
 
 import os
-from qdrant_client import QdrantClient
 from dotenv import load_dotenv
 
+from qdrant_client_singleton import get_client as _get_client
+
 load_dotenv()
 
-QDRANT_URL = os.getenv("QDRANT_URL")
-QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
 COLLECTION_NAME = os.getenv("COLLECTION_NAME", "chest_xrays")
 
-_client = None
-
-
-def _get_client() -> QdrantClient:
-    global _client
-    if _client is None:
-        _client = QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY)
-        print(f"[QdrantService] Connected to {QDRANT_URL}")
-    return _client
-
 
 def _compute_context_score(payload: dict, profile: dict) -> float:
     if not profile:
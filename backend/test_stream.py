@@ -7,6 +7,14 @@ load_dotenv()
 HF_TOKEN = os.getenv("HF_TOKEN")
 MEDGEMMA_ENDPOINT = os.getenv("MEDGEMMA_ENDPOINT")
 
+# One long-lived client, closed only at script exit: every call made in this
+# process shares the warm TLS session instead of paying the handshake per call.
+client = httpx.AsyncClient(
+    http2=True,
+    timeout=60.0,
+    limits=httpx.Limits(max_keepalive_connections=20, keepalive_expiry=60.0),
+)
+
 async def test_stream():
     headers = {
         "Authorization": f"Bearer {HF_TOKEN}",
@@ -20,10 +28,16 @@ async def test_stream():
         "parameters": {"max_new_tokens": 50},
         "stream": True # Try at top level
     }
-    async with httpx.AsyncClient() as client:
-        async with client.stream("POST", MEDGEMMA_ENDPOINT, json=payload, headers=headers) as resp:
-            print("Status:", resp.status_code)
-            async for chunk in resp.aiter_text():
-                print("Chunk:", repr(chunk))
+    async with client.stream("POST", MEDGEMMA_ENDPOINT, json=payload, headers=headers) as resp:
+        print("Status:", resp.status_code)
+        async for chunk in resp.aiter_text():
+            print("Chunk:", repr(chunk))
+
+
+async def main():
+    try:
+        await test_stream()
+    finally:
+        await client.aclose()
 
-asyncio.run(test_stream())
+asyncio.run(main())
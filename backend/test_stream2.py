@@ -7,6 +7,14 @@ load_dotenv()
 HF_TOKEN = os.getenv("HF_TOKEN")
 MEDGEMMA_ENDPOINT = os.getenv("MEDGEMMA_ENDPOINT")
 
+# One long-lived client, closed only at script exit: every call made in this
+# process shares the warm TLS session instead of paying the handshake per call.
+client = httpx.AsyncClient(
+    http2=True,
+    timeout=60.0,
+    limits=httpx.Limits(max_keepalive_connections=20, keepalive_expiry=60.0),
+)
+
 async def test_stream():
     headers = {
         "Authorization": f"Bearer {HF_TOKEN}",
@@ -21,12 +29,18 @@ async def test_stream():
         "parameters": {"max_new_tokens": 50},
         "stream": True
     }
-    async with httpx.AsyncClient() as client:
-        # Some HF TGI endpoints support /generate_stream
-        url = MEDGEMMA_ENDPOINT
-        async with client.stream("POST", url, json=payload, headers=headers) as resp:
-            print("Status:", resp.status_code)
-            async for chunk in resp.aiter_text():
-                print("Chunk:", repr(chunk))
+    # Some HF TGI endpoints support /generate_stream
+    url = MEDGEMMA_ENDPOINT
+    async with client.stream("POST", url, json=payload, headers=headers) as resp:
+        print("Status:", resp.status_code)
+        async for chunk in resp.aiter_text():
+            print("Chunk:", repr(chunk))
+
+
+async def main():
+    try:
+        await test_stream()
+    finally:
+        await client.aclose()
 
-asyncio.run(test_stream())
+asyncio.run(main())